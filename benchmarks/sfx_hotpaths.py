@@ -0,0 +1,538 @@
+"""
+Benchmarks the SFX cog's hot paths against fakes, so changes can be judged with numbers.
+
+The cog is loaded for real, but Red's Config is replaced with an in-memory fake,
+Lavalink with an in-process fake player, and the TTS API with a local server. Each
+scenario fires events at the listeners one at a time and reports how long each took
+to reach Lavalink, through the coalescer, debouncer and scheduler, and how much memory
+was still allocated per event afterwards, at 1, 100 and 10,000 guilds.
+
+Needs Red-DiscordBot and its dependencies installed. Run it from the repo root:
+
+    python benchmarks/sfx_hotpaths.py [--events 2000] [--guilds 1 100 10000]
+"""
+
+import argparse
+import asyncio
+import gc
+import itertools
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import lavalink  # noqa: E402
+from redbot.core import Config  # noqa: E402
+
+import sfx.sfx  # noqa: E402
+from sfx.ogg import crc32  # noqa: E402
+
+TRACK_LENGTH = 5  # milliseconds
+# How long to wait for an event's sound to start before counting it as dropped
+START_TIMEOUT = 5  # seconds
+
+
+# Red's Config
+
+
+class FakeValue:
+    def __init__(self, data: dict, key: str):
+        self._data = data
+        self._key = key
+
+    async def __call__(self):
+        return self._data[self._key]
+
+    async def set(self, value) -> None:
+        self._data[self._key] = value
+
+    async def clear(self) -> None:
+        self._data.pop(self._key, None)
+
+
+class FakeGroup:
+    def __init__(self, store: dict, defaults: dict):
+        self._store = store
+        self._defaults = defaults
+
+    def __getattr__(self, key: str) -> FakeValue:
+        if key.startswith("_"):
+            raise AttributeError(key)
+        self._store.setdefault(key, self._defaults.get(key))
+        return FakeValue(self._store, key)
+
+    async def all(self) -> dict:
+        return {**self._defaults, **self._store}
+
+    async def clear(self) -> None:
+        self._store.clear()
+
+
+class FakeConfig(FakeGroup):
+    """
+    Just enough of Config for the cog, kept in memory.
+    """
+
+    def __init__(self):
+        super().__init__({}, {})
+        self._scopes: Dict[str, Dict[int, dict]] = {"GUILD": {}, "USER": {}}
+        self._scope_defaults: Dict[str, dict] = {"GUILD": {}, "USER": {}}
+
+    def register_global(self, **defaults) -> None:
+        self._defaults.update(defaults)
+
+    def register_guild(self, **defaults) -> None:
+        self._scope_defaults["GUILD"].update(defaults)
+
+    def register_user(self, **defaults) -> None:
+        self._scope_defaults["USER"].update(defaults)
+
+    def _group(self, scope: str, id: int) -> FakeGroup:
+        return FakeGroup(
+            self._scopes[scope].setdefault(id, {}), self._scope_defaults[scope]
+        )
+
+    def guild(self, guild) -> FakeGroup:
+        return self._group("GUILD", guild.id)
+
+    def guild_from_id(self, id: int) -> FakeGroup:
+        return self._group("GUILD", id)
+
+    def user(self, user) -> FakeGroup:
+        return self._group("USER", user.id)
+
+    def user_from_id(self, id: int) -> FakeGroup:
+        return self._group("USER", id)
+
+    async def all_guilds(self) -> Dict[int, dict]:
+        defaults = self._scope_defaults["GUILD"]
+        return {id: {**defaults, **data} for id, data in self._scopes["GUILD"].items()}
+
+
+# Discord
+
+
+class FakePermissions:
+    speak = connect = send_messages = attach_files = True
+
+
+class FakeChannel:
+    def __init__(self, id: int, guild: "FakeGuild"):
+        self.id = id
+        self.guild = guild
+        self.name = f"channel-{id}"
+
+    def permissions_for(self, member) -> FakePermissions:
+        return FakePermissions()
+
+    async def send(self, *args, **kwargs) -> None:
+        pass
+
+
+class FakeMember:
+    def __init__(self, id: int, guild: "FakeGuild", bot: bool = False):
+        self.id = id
+        self.guild = guild
+        self.bot = bot
+        self.name = self.display_name = f"member-{id}"
+        self.roles = [SimpleNamespace(id=guild.id)]
+        self.voice = None
+
+
+class FakeGuild:
+    def __init__(self, id: int):
+        self.id = id
+        self.name = f"guild-{id}"
+        self.text = FakeChannel(id * 10 + 1, self)
+        self.voice_channel = FakeChannel(id * 10 + 2, self)
+        self.me = FakeMember(1, self, bot=True)
+        self.member = FakeMember(id * 10 + 3, self)
+        self.member.voice = SimpleNamespace(channel=self.voice_channel)
+
+    def get_member(self, id: int):
+        return self.member if id == self.member.id else None
+
+    def get_role(self, id: int):
+        return None
+
+    def get_channel(self, id: int):
+        return {self.text.id: self.text, self.voice_channel.id: self.voice_channel}.get(
+            id
+        )
+
+
+class FakeCommand:
+    async def can_run(self, ctx, change_permission_state: bool = False) -> bool:
+        return True
+
+
+class FakeBot:
+    def __init__(self, guilds: Dict[int, FakeGuild]):
+        self.loop = asyncio.get_running_loop()
+        self.user = SimpleNamespace(id=1)
+        self.guilds = guilds
+
+    def get_guild(self, id: int):
+        return self.guilds.get(id)
+
+    async def wait_until_red_ready(self) -> None:
+        pass
+
+    async def allowed_by_whitelist_blacklist(self, who=None) -> bool:
+        return True
+
+    async def cog_disabled_in_guild(self, cog, guild) -> bool:
+        return False
+
+    async def get_shared_api_tokens(self, service: str) -> dict:
+        return {}
+
+    async def get_context(self, message):
+        return SimpleNamespace(message=message)
+
+    def get_command(self, name: str) -> FakeCommand:
+        return FakeCommand()
+
+
+# Lavalink
+
+
+class FakeTrack:
+    def __init__(self, query: str):
+        self.uri = query
+        self.track_identifier = query
+        self.length = TRACK_LENGTH
+        self.title = self.author = ""
+        self.requester = None
+
+
+class FakePlayer:
+    """
+    Plays tracks by waiting out their length, and sends Lavalink's events.
+    """
+
+    def __init__(self, guild: FakeGuild, lavalink: "FakeLavalink"):
+        self.guild = guild
+        self.node = SimpleNamespace(host="127.0.0.1", port=2333)
+        self.queue: List[FakeTrack] = []
+        self.current = None
+        self.position = 0
+        self.repeat = False
+        self._lavalink = lavalink
+        self._timer = None
+
+    async def load_tracks(self, query: str):
+        await asyncio.sleep(0)
+        return SimpleNamespace(tracks=[FakeTrack(query)])
+
+    def _advance(self) -> None:
+        previous = self.current
+        self.current = self.queue.pop(0) if self.queue else None
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        if previous:
+            asyncio.create_task(
+                self._lavalink.dispatch(
+                    self, lavalink.LavalinkEvents.TRACK_END, "FINISHED"
+                )
+            )
+        if self.current:
+            self._timer = asyncio.get_running_loop().call_later(
+                self.current.length / 1000, self._advance
+            )
+
+    async def play(self) -> None:
+        self._advance()
+        self._lavalink.notify(self.guild.id, "start")
+
+    async def skip(self) -> None:
+        self._advance()
+        self._lavalink.notify(self.guild.id, "start")
+
+    async def seek(self, position: int) -> None:
+        self.position = position
+
+
+class FakeLavalink:
+    def __init__(self):
+        self.players: Dict[int, FakePlayer] = {}
+        self.listeners = []
+        self.timings: List[float] = []
+        self._waiters: Dict[Tuple[int, str], asyncio.Future] = {}
+
+    def register_event_listener(self, listener) -> None:
+        self.listeners.append(listener)
+
+    def unregister_event_listener(self, listener) -> None:
+        self.listeners.remove(listener)
+
+    def get_player(self, guild_id: int) -> FakePlayer:
+        return self.players[guild_id]
+
+    async def connect(self, channel: FakeChannel) -> FakePlayer:
+        player = self.players[channel.guild.id] = FakePlayer(channel.guild, self)
+        return player
+
+    def expect(self, guild_id: int, what: str) -> asyncio.Future:
+        """
+        Gets a future that resolves the next time a track starts or ends in a guild.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[(guild_id, what)] = future
+        return future
+
+    def notify(self, guild_id: int, what: str) -> None:
+        future = self._waiters.pop((guild_id, what), None)
+        if future and not future.done():
+            future.set_result(None)
+
+    async def dispatch(self, player: FakePlayer, event, reason) -> None:
+        for listener in self.listeners:
+            start = time.perf_counter()
+            await listener(player, event, reason)
+            self.timings.append(time.perf_counter() - start)
+        self.notify(player.guild.id, "end")
+
+
+# The TTS API
+
+
+def ogg_page(header_type: int, sequence: int, body: bytes) -> bytes:
+    page = bytearray(
+        struct.pack("<4sBBqIIIB", b"OggS", 0, header_type, 0, 1, sequence, 0, 1)
+        + bytes([len(body)])
+        + body
+    )
+    struct.pack_into("<I", page, 22, crc32(page))
+    return bytes(page)
+
+
+AUDIO = ogg_page(0x02, 0, b"OpusHead" + bytes(11)) + ogg_page(0x04, 1, bytes(200))
+VOICES = {
+    "voices": [
+        {
+            "name": "Christopher",
+            "gender": "Male",
+            "source": "Benchmark",
+            "language": {"name": "English", "code": "en-US"},
+        }
+    ]
+}
+
+
+async def start_tts_api() -> web.AppRunner:
+    async def tts(request: web.Request) -> web.Response:
+        return web.Response(body=AUDIO, content_type="audio/ogg")
+
+    async def voices(request: web.Request) -> web.Response:
+        return web.json_response(VOICES)
+
+    app = web.Application()
+    app.router.add_get("/v1/tts", tts)
+    app.router.add_get("/v1/tts/voices", voices)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    return runner
+
+
+# Scenarios
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def report(
+    name: str,
+    guilds: int,
+    timings: List[float],
+    retained: Optional[int] = None,
+    dropped: int = 0,
+) -> None:
+    if not timings:
+        print(f"{name:<12} {guilds:>6}  (no events)")
+        return
+    line = (
+        f"{name:<12} {guilds:>6}"
+        f"  p50 {percentile(timings, 0.5) * 1e6:>8.1f}µs"
+        f"  p95 {percentile(timings, 0.95) * 1e6:>8.1f}µs"
+        f"  p99 {percentile(timings, 0.99) * 1e6:>8.1f}µs"
+    )
+    if retained is not None:
+        line += f"  {retained / (len(timings) + dropped):>9.0f} B/event retained"
+    if dropped:
+        line += f"  {dropped} dropped"
+    print(line)
+
+
+async def measure(
+    events: int,
+    guilds: List[FakeGuild],
+    fire: Callable[[FakeGuild, int], Awaitable],
+    fake_lavalink: FakeLavalink,
+) -> Tuple[List[float], int, int]:
+    """
+    Fires events round robin over the guilds, once for latency and once for memory.
+
+    Each event is timed until its sound starts playing, and its sound is left to
+    finish before the next event, so one event's playback isn't counted in the
+    next one's time. Events whose sound never starts are counted as dropped.
+
+    The memory figure is how much more memory was allocated after the second pass
+    than before it, which is what the pipeline holds on to, not what it allocates
+    along the way.
+    """
+    cycle = itertools.cycle(guilds)
+
+    async def fire_all(offset: int) -> Tuple[List[float], int]:
+        timings = []
+        dropped = 0
+        for i in range(events):
+            guild = next(cycle)
+            started = fake_lavalink.expect(guild.id, "start")
+            ended = fake_lavalink.expect(guild.id, "end")
+            start = time.perf_counter()
+            await fire(guild, offset + i)
+            try:
+                await asyncio.wait_for(started, timeout=START_TIMEOUT)
+            except asyncio.TimeoutError:
+                dropped += 1
+                continue
+            timings.append(time.perf_counter() - start)
+            await asyncio.wait_for(ended, timeout=START_TIMEOUT)
+            # Let the scheduler's worker see the sound has finished
+            await asyncio.sleep(0)
+        return timings, dropped
+
+    timings, dropped = await fire_all(0)
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    await fire_all(events)
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    retained = sum(
+        stat.size_diff
+        for stat in after.compare_to(before, "filename")
+        if stat.size_diff > 0
+    )
+    return timings, retained, dropped
+
+
+async def run(guild_count: int, events: int, tts_api: str) -> None:
+    guilds = {id: FakeGuild(id) for id in range(1000, 1000 + guild_count)}
+    fake_lavalink = FakeLavalink()
+    config = FakeConfig()
+
+    sfx.sfx.lavalink.register_event_listener = fake_lavalink.register_event_listener
+    sfx.sfx.lavalink.unregister_event_listener = fake_lavalink.unregister_event_listener
+    sfx.sfx.lavalink.get_player = fake_lavalink.get_player
+    sfx.sfx.lavalink.connect = fake_lavalink.connect
+    Config.get_conf = staticmethod(lambda *args, **kwargs: config)
+    data_path = Path(tempfile.mkdtemp(prefix="sfx-benchmark-"))
+    sfx.sfx.cog_data_path = lambda *args, **kwargs: data_path
+    sfx.sfx.SFX.TTS_API_URL = tts_api
+
+    cog = sfx.sfx.SFX(FakeBot(guilds))
+    await asyncio.sleep(0.1)
+    await cog.refresh_voices()
+    # Events are fired one at a time, so the time spent deliberately waiting to merge
+    # them or pace requests would only hide the time spent processing them
+    cog.joinleave_debouncer.window = cog.joinleave_debouncer.interval = 0
+    cog.flowery.limiter = None
+
+    join_url = f"{tts_api}?join"
+    for guild in guilds.values():
+        await config.guild(guild).join_sound.set(join_url)
+        await config.guild(guild).coalesce_window.set(0)
+        await config.guild(guild).channels.set([guild.text.id])
+        cog.tts_channels[guild.id] = {guild.text.id}
+    # Don't benchmark downloading the join sound to the sound store
+    cog.failed_sound_urls.add(join_url)
+
+    def message(guild: FakeGuild, i: int, channel: FakeChannel):
+        return SimpleNamespace(
+            id=i,
+            guild=guild,
+            author=guild.member,
+            channel=channel,
+            content=f"Benchmark message number {i % 50}",
+            clean_content=f"Benchmark message number {i % 50}",
+        )
+
+    async def ttschannel(guild: FakeGuild, i: int) -> None:
+        await cog.ttschannels_message_listener(message(guild, i, guild.text))
+
+    async def autotts(guild: FakeGuild, i: int) -> None:
+        cog.autotts.setdefault(guild.id, set()).add(guild.member.id)
+        try:
+            await cog.autotts_message_listener(message(guild, i, guild.text))
+        finally:
+            cog.autotts.pop(guild.id, None)
+
+    async def joinleave(guild: FakeGuild, i: int) -> None:
+        before = SimpleNamespace(channel=None)
+        after = SimpleNamespace(channel=guild.voice_channel)
+        await cog.joinleave_voice_listener(guild.member, before, after)
+
+    async def play_sound(guild: FakeGuild, i: int) -> None:
+        await cog.play_sound(
+            guild.voice_channel,
+            None,
+            "joinleave",
+            f"{tts_api}?sound={i % 20}",
+            ("Benchmark", guild.member),
+        )
+
+    for name, fire in (
+        ("ttschannel", ttschannel),
+        ("autotts", autotts),
+        ("joinleave", joinleave),
+        ("play_sound", play_sound),
+    ):
+        timings, retained, dropped = await measure(
+            events, list(guilds.values()), fire, fake_lavalink
+        )
+        report(name, guild_count, timings, retained, dropped)
+
+    # Let queued sounds play out, so ll_check sees the events they cause
+    for _ in range(200):
+        if not cog.scheduler.stats()["queued"] and not cog.playback.counts()["waiting"]:
+            break
+        await asyncio.sleep(TRACK_LENGTH / 1000)
+    report("ll_check", guild_count, fake_lavalink.timings)
+
+    cog.cog_unload()
+    await asyncio.sleep(0.1)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--guilds", type=int, nargs="+", default=[1, 100, 10000])
+    args = parser.parse_args()
+
+    tts_api = await start_tts_api()
+    port = tts_api.addresses[0][1]
+    try:
+        for guild_count in args.guilds:
+            await run(guild_count, args.events, f"http://127.0.0.1:{port}/v1/tts")
+    finally:
+        await tts_api.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -8,4 +8,4 @@ async def setup(bot: Red):
     await bot.add_cog(cog)
 
 
-__red_end_user_data_statement__ = "This cog stores a user's voice name, links to their join and leave sounds, and if their TTS should be translated. All this data is able to be deleted."
+__red_end_user_data_statement__ = "This cog stores a user's voice name, their join and leave sounds, including a copy of the audio files, if their TTS should be translated, and which servers they have AutoTTS enabled in. All this data is able to be deleted. It also keeps a cache of rendered text to speech audio, which includes audio of messages users have had read out. The cache isn't linked to users, so it can't be deleted per user, but old audio is removed as the cache fills up and the bot owner can clear it."
@@ -9,6 +9,20 @@ from .abc import MixinMeta
 
 
 class AutoTTSMixin(MixinMeta):
+    async def set_autotts(self, guild_id: int, user_id: int, enabled: bool) -> None:
+        """
+        Enables or disables AutoTTS for a user in a guild and saves it.
+        """
+        users = self.autotts.setdefault(guild_id, set())
+        if enabled:
+            users.add(user_id)
+        else:
+            users.discard(user_id)
+        if not users:
+            del self.autotts[guild_id]
+
+        await self.config.guild_from_id(guild_id).autotts_users.set(list(users))
+
     @commands.group(invoke_without_command=True)
     @commands.guild_only()
     async def autotts(self, ctx: Context):
@@ -18,14 +32,14 @@ class AutoTTSMixin(MixinMeta):
         If the server subcommand isn't used, it will toggle it for yourself.
         """
         toggle = await self.config.guild(ctx.guild).allow_autotts()
-        if ctx.author.id in self.autotts:
-            self.autotts.remove(ctx.author.id)
+        if ctx.author.id in self.autotts.get(ctx.guild.id, ()):
+            await self.set_autotts(ctx.guild.id, ctx.author.id, False)
             await ctx.send("I will no longer automatically say your messages as TTS.")
         else:
             if not toggle:
                 await ctx.send("AutoTTS is disallowed on this server.")
                 return
-            self.autotts.append(ctx.author.id)
+            await self.set_autotts(ctx.guild.id, ctx.author.id, True)
             await ctx.send("I will now automatically say your messages as TTS.")
 
     @autotts.command(name="server")
@@ -36,9 +50,11 @@ class AutoTTSMixin(MixinMeta):
         toggle = await self.config.guild(ctx.guild).allow_autotts()
         if toggle:
             await self.config.guild(ctx.guild).allow_autotts.set(False)
+            self.config_cache.update_guild(ctx.guild.id, allow_autotts=False)
             await ctx.send("AutoTTS is now disallowed for this server.")
         else:
             await self.config.guild(ctx.guild).allow_autotts.set(True)
+            self.config_cache.update_guild(ctx.guild.id, allow_autotts=True)
             await ctx.send("AutoTTS is now allowed for this server.")
 
     @commands.Cog.listener(name="on_message_without_command")
@@ -47,13 +63,16 @@ class AutoTTSMixin(MixinMeta):
         Listens for messages to be sent and checks if they are
         eligible to be spoken through AutoTTS.
         """
+        if not message.guild or message.author.bot:
+            return
+        if message.author.id not in self.autotts.get(message.guild.id, ()):
+            return
+
+        guild_config = await self.config_cache.guild(message.guild)
         if (
-            message.author.id not in self.autotts
-            or not message.guild
-            or message.author.bot
+            not guild_config["allow_autotts"]
             or not await self.bot.allowed_by_whitelist_blacklist(who=message.author)
             or await self.bot.cog_disabled_in_guild(self, message.guild)
-            or not await self.config.guild(message.guild).allow_autotts()
             or not message.author.voice
             or not message.author.voice.channel
             or not message.author.voice.channel.permissions_for(message.author).speak
@@ -61,12 +80,21 @@ class AutoTTSMixin(MixinMeta):
         ):
             return
 
-        await self.play_tts(
-            message.author,
-            message.author.voice.channel,
-            message.channel,
-            "autotts",
+        author, channel = message.author, message.channel
+
+        async def speak(text: str):
+            if author.voice and author.voice.channel:
+                text = await self.process_text(channel.guild, author, text)
+                await self.play_tts(
+                    author, author.voice.channel, channel, "autotts", text
+                )
+
+        self.coalescer.add(
+            (message.guild.id, author.id),
             message.clean_content,
+            speak,
+            guild_config["coalesce_window"],
+            guild_config["coalesce_max_length"],
         )
 
     @commands.Cog.listener(name="on_voice_state_update")
@@ -80,15 +108,14 @@ class AutoTTSMixin(MixinMeta):
         Checks if a user has left a voice channel and disables
         AutoTTS if it had previously been enabled.
         """
-        if (
-            member.bot
-            or not await self.bot.allowed_by_whitelist_blacklist(who=member)
-            or await self.bot.cog_disabled_in_guild(self, member.guild)
-            or member.id not in self.autotts
-        ):
+        if member.bot or member.id not in self.autotts.get(member.guild.id, ()):
+            return
+        if not await self.bot.allowed_by_whitelist_blacklist(who=member):
+            return
+        if await self.bot.cog_disabled_in_guild(self, member.guild):
             return
         if before.channel and not after.channel:
-            self.autotts.remove(member.id)
+            await self.set_autotts(member.guild.id, member.id, False)
             embed = discord.Embed(
                 title="AutoTTS Disabled",
                 color=await self.bot.get_embed_color(member.guild),
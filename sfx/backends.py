@@ -0,0 +1,409 @@
+import asyncio
+import shutil
+import time
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote
+
+import aiohttp
+
+from .health import HealthTracker
+from .ratelimit import RateLimited, RateLimiter, retry_after
+
+
+class TTSError(Exception):
+    """
+    Raised when a TTS backend couldn't render something.
+
+    retry_after is how long the backend asked us to wait, if it did.
+    """
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RenderInfo:
+    """
+    What's learned about a render while it streams.
+
+    fallback is set if any of the audio came from a fallback backend, which
+    shouldn't be cached as if it were the real voice.
+    """
+
+    __slots__ = ("fallback",)
+
+    def __init__(self):
+        self.fallback = False
+
+
+class TTSBackend(ABC):
+    """
+    Something that turns text into audio.
+
+    Fallback backends don't sound like the voice that was asked for, so they're only
+    used when no other backend can render.
+    """
+
+    name: str
+    fallback = False
+
+    @property
+    def available(self) -> bool:
+        """
+        Whether the backend can be used at all, such as whether its programs are installed.
+        """
+        return True
+
+    @abstractmethod
+    def stream(
+        self,
+        voice: str,
+        translate: bool,
+        text: str,
+        speed: float,
+        format: str,
+        guild_id: Optional[int] = None,
+        silence: int = 500,
+    ) -> AsyncIterator[bytes]:
+        """
+        Renders text for a guild, yielding the audio as it's ready.
+
+        silence is how many milliseconds of silence to end the audio with.
+        Raises TTSError if it fails, or RateLimited if it couldn't start in time.
+        """
+
+
+class FloweryBackend(TTSBackend):
+    """
+    The Flowery TTS API.
+
+    Requests are paced by the limiter, and a 429 pauses it for as long as the API asks.
+    """
+
+    name = "flowery"
+
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        api_url: str,
+        limiter: Optional[RateLimiter] = None,
+    ):
+        self.session = session
+        self.api_url = api_url
+        self.limiter = limiter
+
+    def url(
+        self,
+        voice: str,
+        translate: bool,
+        text: str,
+        speed: float,
+        format: str,
+        silence: int = 500,
+    ) -> str:
+        return f"{self.api_url}?voice={voice}&translate={translate}&text={quote(text)}&silence={silence}&audio_format={format}&speed={speed}"
+
+    async def stream(
+        self,
+        voice: str,
+        translate: bool,
+        text: str,
+        speed: float,
+        format: str,
+        guild_id: Optional[int] = None,
+        silence: int = 500,
+    ) -> AsyncIterator[bytes]:
+        if self.limiter:
+            await self.limiter.acquire(guild_id)
+        try:
+            async with self.session.get(
+                self.url(voice, translate, text, speed, format, silence)
+            ) as resp:
+                if resp.status == 429:
+                    delay = retry_after(resp.headers)
+                    if self.limiter:
+                        self.limiter.pause(delay)
+                    raise TTSError("The TTS API is rate limiting us", delay)
+                if resp.status != 200:
+                    raise TTSError(f"The TTS API returned {resp.status}")
+                async for chunk in resp.content.iter_any():
+                    yield chunk
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise TTSError(str(e)) from e
+
+
+class LocalBackend(TTSBackend):
+    """
+    Renders speech on this machine with eSpeak NG, encoded with FFmpeg.
+
+    It sounds robotic and can't translate, so it's only a fallback for when the TTS
+    API is down, disabled or rate limited. Voices are matched to eSpeak by their
+    language and gender, and only a few renders run at once.
+    """
+
+    name = "local"
+    fallback = True
+    FORMATS = {
+        "ogg_opus": ("-c:a", "libopus", "-b:a", "48k", "-f", "ogg"),
+        "mp3": ("-c:a", "libmp3lame", "-q:a", "4", "-f", "mp3"),
+    }
+
+    def __init__(
+        self,
+        voice_info: Callable[[str], Optional[dict]],
+        workers: int = 2,
+        timeout: float = 30,
+    ):
+        self.voice_info = voice_info
+        self.timeout = timeout
+        self.espeak = shutil.which("espeak-ng")
+        self.ffmpeg = shutil.which("ffmpeg")
+        self._workers = asyncio.Semaphore(workers)
+
+    @property
+    def available(self) -> bool:
+        return bool(self.espeak and self.ffmpeg)
+
+    def espeak_voice(self, voice: str) -> str:
+        info = self.voice_info(voice) or {}
+        # eSpeak knows most languages by their ISO 639 code, but not most regions
+        code = str((info.get("language") or {}).get("code") or "en")
+        language = code.split("-")[0].lower()
+        variant = "+f3" if str(info.get("gender", "")).lower() == "female" else "+m3"
+        return language + variant
+
+    async def _run(self, args: Tuple[str, ...], input: bytes) -> bytes:
+        proc = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        try:
+            stdout, _ = await asyncio.wait_for(
+                proc.communicate(input), timeout=self.timeout
+            )
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            proc.kill()
+            await proc.wait()
+            raise
+        if proc.returncode != 0 or not stdout:
+            raise TTSError(f"{args[0]} exited with {proc.returncode}")
+        return stdout
+
+    async def stream(
+        self,
+        voice: str,
+        translate: bool,
+        text: str,
+        speed: float,
+        format: str,
+        guild_id: Optional[int] = None,
+        silence: int = 500,
+    ) -> AsyncIterator[bytes]:
+        if not self.available:
+            raise TTSError("eSpeak NG and FFmpeg need to be installed")
+        if format not in self.FORMATS:
+            raise TTSError(f"Can't render {format} locally")
+
+        async with self._workers:
+            try:
+                wav = await self._run(
+                    (
+                        self.espeak,
+                        "--stdout",
+                        "-v",
+                        self.espeak_voice(voice),
+                        "-s",
+                        str(int(175 * speed)),
+                        "--stdin",
+                    ),
+                    text.encode(),
+                )
+                pad = ("-af", f"apad=pad_dur={silence / 1000}") if silence else ()
+                audio = await self._run(
+                    (self.ffmpeg, "-v", "error", "-i", "pipe:0", "-vn")
+                    + pad
+                    + self.FORMATS[format]
+                    + ("pipe:1",),
+                    wav,
+                )
+            except (asyncio.TimeoutError, OSError) as e:
+                raise TTSError(str(e) or "Rendering took too long") from e
+        yield audio
+
+
+class BackendStats:
+    __slots__ = ("health", "latency", "enabled")
+
+    def __init__(self):
+        self.health = HealthTracker()
+        # An exponentially weighted average of the time to the first audio, in seconds
+        self.latency: Optional[float] = None
+        self.enabled = True
+
+    def observe(self, latency: float, alpha: float = 0.3) -> None:
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += alpha * (latency - self.latency)
+
+
+class TTSRouter:
+    """
+    Picks which backend renders TTS, by health and how fast each one has been lately.
+
+    If the first backend hasn't produced any audio by the hedging deadline, the next
+    one is started too and whichever answers first is used. Backends that fail are
+    backed off, and the next one is tried right away. So is the next one if a backend
+    is rate limited, but that doesn't count against its health.
+
+    Fallback backends are never ranked against the others. They're tried once every
+    other backend has failed, is backing off or is disabled, and hedged with once no
+    other backend is left to hedge with, so a slow API doesn't hold everything up.
+    """
+
+    def __init__(self, backends: List[TTSBackend], hedge_after: float = 2.0):
+        self.backends = backends
+        self.hedge_after = hedge_after
+        self.stats: Dict[str, BackendStats] = {b.name: BackendStats() for b in backends}
+
+    def get(self, name: str) -> Optional[TTSBackend]:
+        for backend in self.backends:
+            if backend.name == name:
+                return backend
+        return None
+
+    def _usable(self, fallback: bool) -> List[TTSBackend]:
+        return [
+            b
+            for b in self.backends
+            if b.fallback is fallback and self.stats[b.name].enabled and b.available
+        ]
+
+    def order(self) -> List[TTSBackend]:
+        """
+        Lists the backends worth trying first, best first. Fallbacks aren't included.
+
+        Backends whose latency hasn't been measured yet come after the ones that have.
+        Backends in backoff are only included when there's no fallback to use instead.
+        """
+        usable = self._usable(False)
+        ready = [b for b in usable if self.stats[b.name].health.available]
+        if not ready and self.fallbacks():
+            return []
+        return sorted(
+            ready or usable,
+            key=lambda b: (
+                not self.stats[b.name].health.healthy,
+                self.stats[b.name].latency is None,
+                self.stats[b.name].latency or 0.0,
+            ),
+        )
+
+    def fallbacks(self) -> List[TTSBackend]:
+        """
+        Lists the fallback backends, to try in order once the others can't render.
+        """
+        return self._usable(True)
+
+    async def stream(
+        self,
+        voice: str,
+        translate: bool,
+        text: str,
+        speed: float,
+        format: str,
+        guild_id: Optional[int] = None,
+        info: Optional[RenderInfo] = None,
+        silence: int = 500,
+    ) -> AsyncIterator[bytes]:
+        """
+        Renders text with the best backend, yielding the audio as it's ready.
+
+        If info is given, it's marked when a fallback backend renders.
+        silence is how many milliseconds of silence to end the audio with.
+        Raises RateLimited if a backend was held back by its rate limit and none of
+        the others could render it, or TTSError if no backend could render it.
+        """
+        primaries = iter(self.order())
+        fallbacks = iter(self.fallbacks())
+        attempts: Dict[asyncio.Task, Tuple[TTSBackend, AsyncIterator[bytes], float]] = (
+            {}
+        )
+
+        def launch(candidates: Iterator[TTSBackend]) -> bool:
+            backend = next(candidates, None)
+            if backend is None:
+                return False
+            chunks = backend.stream(
+                voice, translate, text, speed, format, guild_id, silence
+            )
+            task = asyncio.ensure_future(chunks.__anext__())
+            attempts[task] = (backend, chunks, time.monotonic())
+            return True
+
+        winner = None
+        limited = False
+        launch(primaries) or launch(fallbacks)
+        try:
+            while attempts and not winner:
+                done, _ = await asyncio.wait(
+                    attempts,
+                    timeout=self.hedge_after,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    # Hedge with another backend, and with a fallback as a last resort
+                    launch(primaries) or launch(fallbacks)
+                    continue
+
+                for task in done:
+                    backend, chunks, started = attempts.pop(task)
+                    stats = self.stats[backend.name]
+                    try:
+                        first = task.result()
+                    except RateLimited:
+                        limited = True
+                        continue
+                    except StopAsyncIteration:
+                        stats.health.failure()
+                        continue
+                    except TTSError as e:
+                        stats.health.failure(e.retry_after)
+                        continue
+                    stats.health.success()
+                    stats.observe(time.monotonic() - started)
+                    winner = (backend, chunks, first)
+                    break
+
+                if not attempts and not winner:
+                    launch(primaries) or launch(fallbacks)
+        finally:
+            # The losers were at least this slow
+            for task, (backend, _, started) in attempts.items():
+                task.cancel()
+                self.stats[backend.name].observe(time.monotonic() - started)
+            # Their generators can only be closed once they've stopped running
+            await asyncio.gather(*attempts, return_exceptions=True)
+            for _, chunks, _ in attempts.values():
+                await chunks.aclose()
+
+        if not winner and limited:
+            raise RateLimited("The TTS API is busy")
+        if not winner:
+            raise TTSError("No TTS backend could render that")
+
+        backend, chunks, first = winner
+        if info and backend.fallback:
+            info.fallback = True
+        try:
+            yield first
+            async for chunk in chunks:
+                yield chunk
+        except TTSError as e:
+            self.stats[backend.name].health.failure(e.retry_after)
+            raise
+        finally:
+            await chunks.aclose()
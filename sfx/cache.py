@@ -0,0 +1,159 @@
+import asyncio
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+
+from .normalize import canonical
+
+
+class TTSCache:
+    """
+    A content-addressed, size-bounded LRU cache of rendered TTS audio on disk.
+
+    Entries are keyed by everything that changes the rendered audio, so the same
+    phrase in the same voice is only ever synthesized once while it stays cached.
+    """
+
+    EXTENSIONS = {"ogg_opus": "ogg", "mp3": "mp3"}
+
+    def __init__(self, path: Path, max_size: int):
+        self.path = path
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._load()
+
+    def _load(self) -> None:
+        """
+        Rebuilds the index from the files on disk, oldest access first.
+        """
+        files = []
+        for entry in os.scandir(self.path):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self.size += size
+
+        self._evict()
+
+    @staticmethod
+    def make_key(
+        voice: str,
+        translate: bool,
+        text: str,
+        speed: float,
+        audio_format: str,
+        backend: Optional[str] = None,
+        silence: int = 500,
+    ) -> str:
+        """
+        Generates the cache key for a TTS render.
+
+        Renders from a fallback backend pass its name, so they're never found by
+        lookups for the real voice. Renders with other than the usual 500 ms of
+        silence at the end pass that too.
+        """
+        fields = [voice, bool(translate), canonical(text), float(speed), audio_format]
+        if backend:
+            fields.append(backend)
+        if silence != 500:
+            fields.append(int(silence))
+        raw = json.dumps(fields)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def _filename(self, key: str, audio_format: str) -> str:
+        return f"{key}.{self.EXTENSIONS.get(audio_format, audio_format)}"
+
+    def get(self, key: str, audio_format: str) -> Optional[Path]:
+        """
+        Returns the path of a cached render, or None if it isn't cached.
+        """
+        name = self._filename(key, audio_format)
+        path = self.path / name
+
+        if name not in self._entries or not path.is_file():
+            if name in self._entries:
+                self.size -= self._entries.pop(name)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(name)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return path
+
+    def _write(self, path: Path, data: bytes) -> None:
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+    async def put(self, key: str, audio_format: str, data: bytes) -> Path:
+        """
+        Stores a render and evicts the least recently used entries if needed.
+        """
+        name = self._filename(key, audio_format)
+        path = self.path / name
+
+        await asyncio.get_running_loop().run_in_executor(None, self._write, path, data)
+
+        if name in self._entries:
+            self.size -= self._entries.pop(name)
+        self._entries[name] = len(data)
+        self.size += len(data)
+        self._evict(keep=name)
+        return path
+
+    def _evict(self, keep: Optional[str] = None) -> None:
+        while self._entries and self.size > self.max_size:
+            name, size = next(iter(self._entries.items()))
+            if name == keep:
+                break
+            del self._entries[name]
+            self.size -= size
+            try:
+                (self.path / name).unlink()
+            except FileNotFoundError:
+                pass
+
+    def resize(self, max_size: int) -> None:
+        """
+        Changes the maximum size of the cache.
+        """
+        self.max_size = max_size
+        self._evict()
+
+    def clear(self) -> None:
+        """
+        Removes every cached render.
+        """
+        for name in self._entries:
+            try:
+                (self.path / name).unlink()
+            except FileNotFoundError:
+                pass
+        self._entries.clear()
+        self.size = 0
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the hit/miss counters and the current cache usage.
+        """
+        return {
+            "entries": len(self._entries),
+            "size": self.size,
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
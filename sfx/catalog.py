@@ -0,0 +1,182 @@
+import contextlib
+from typing import Dict, List, Optional
+
+import discord
+from redbot.core.commands import Context
+
+from .ratelimit import RateLimited
+from .voices import VoiceIndex
+
+
+class VoiceCatalog:
+    """
+    The data behind `[p]tts --voices`, prepared once per voice refresh.
+
+    Embeds are only built for the pages that are actually looked at.
+    """
+
+    PAGE_SIZE = 12
+
+    def __init__(self, index: VoiceIndex):
+        self.index = index
+        self.fields: Dict[str, str] = {
+            voice["name"]: (
+                f"• Gender: {voice.get('gender') or 'Unknown'}\n"
+                f"• Language: {(voice.get('language') or {}).get('name') or 'Unknown'}\n"
+                f"• Source: {voice.get('source') or 'Unknown'}"
+            )
+            for voice in index.voices
+        }
+
+    @staticmethod
+    def sample_text(voice: dict) -> str:
+        return f"Hi, I'm {voice['name']}, nice to meet you."
+
+    @staticmethod
+    def parse_filters(terms: List[str]) -> Dict[str, str]:
+        """
+        Parses `language:de gender:female` style filters.
+        """
+        filters = {}
+        for term in terms:
+            key, _, value = term.partition(":")
+            if key.lower() in ("language", "lang", "gender") and value:
+                filters["gender" if key.lower() == "gender" else "language"] = value
+        return filters
+
+    def voices(self, filters: Dict[str, str]) -> List[dict]:
+        return self.index.filter(filters.get("language"), filters.get("gender"))
+
+    def build_embed(
+        self, voices: List[dict], page: int, color: discord.Color
+    ) -> discord.Embed:
+        pages = self.page_count(voices)
+        embed = discord.Embed(color=color)
+        for voice in voices[page * self.PAGE_SIZE : (page + 1) * self.PAGE_SIZE]:
+            embed.add_field(name=voice["name"], value=self.fields[voice["name"]])
+        embed.set_footer(
+            text=f"Page {page + 1}/{pages} | {len(voices)} voices | Pick a voice below to hear it"
+        )
+        return embed
+
+    def page_count(self, voices: List[dict]) -> int:
+        return max((len(voices) - 1) // self.PAGE_SIZE + 1, 1)
+
+
+class VoiceCatalogView(discord.ui.View):
+    """
+    Pages through the voice catalog, and sends voice samples as files.
+
+    Samples are only rendered when they're picked, through the TTS cache, so each
+    one is only rendered once.
+    """
+
+    def __init__(
+        self,
+        ctx: Context,
+        catalog: VoiceCatalog,
+        voices: List[dict],
+        color: discord.Color,
+    ):
+        super().__init__(timeout=120)
+        self.ctx = ctx
+        self.cog = ctx.cog
+        self.catalog = catalog
+        self.voices = voices
+        self.color = color
+        self.page = 0
+        self.pages = catalog.page_count(voices)
+        self.message: Optional[discord.Message] = None
+        self.update_items()
+
+    def page_voices(self) -> List[dict]:
+        size = self.catalog.PAGE_SIZE
+        return self.voices[self.page * size : (self.page + 1) * size]
+
+    def update_items(self) -> None:
+        self.sample.options = [
+            discord.SelectOption(label=voice["name"][:100])
+            for voice in self.page_voices()
+        ]
+        self.previous.disabled = self.pages == 1
+        self.next.disabled = self.pages == 1
+
+    async def start(self) -> None:
+        self.message = await self.ctx.send(
+            embed=self.catalog.build_embed(self.voices, self.page, self.color),
+            view=self,
+        )
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.ctx.author.id:
+            await interaction.response.send_message(
+                "You can't control this menu.", ephemeral=True
+            )
+            return False
+        return True
+
+    async def on_timeout(self) -> None:
+        if self.message:
+            with contextlib.suppress(discord.HTTPException):
+                await self.message.edit(view=None)
+
+    async def show(self, interaction: discord.Interaction) -> None:
+        self.update_items()
+        await interaction.response.edit_message(
+            embed=self.catalog.build_embed(self.voices, self.page, self.color),
+            view=self,
+        )
+
+    @discord.ui.select(placeholder="Hear a sample", row=0)
+    async def sample(self, interaction: discord.Interaction, select: discord.ui.Select):
+        voice = self.cog.get_voice(select.values[0])
+        if not voice:
+            await interaction.response.send_message(
+                "That voice isn't available anymore.", ephemeral=True
+            )
+            return
+
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        try:
+            path = await self.cog.get_tts_audio(
+                voice["name"],
+                False,
+                self.catalog.sample_text(voice),
+                1.0,
+                "mp3",
+                interaction.guild_id,
+            )
+        except RateLimited:
+            await interaction.followup.send(
+                "There's too much TTS being rendered right now, please try again in a bit.",
+                ephemeral=True,
+            )
+            return
+        if not path:
+            await interaction.followup.send(
+                "Something is going wrong with the TTS API, please try again later.",
+                ephemeral=True,
+            )
+            return
+
+        await interaction.followup.send(
+            file=discord.File(str(path), filename=f"{voice['name']}.mp3"),
+            ephemeral=True,
+        )
+
+    @discord.ui.button(emoji="\N{LEFTWARDS BLACK ARROW}", row=1)
+    async def previous(self, interaction: discord.Interaction, _):
+        self.page = (self.page - 1) % self.pages
+        await self.show(interaction)
+
+    @discord.ui.button(emoji="\N{CROSS MARK}", row=1)
+    async def close(self, interaction: discord.Interaction, _):
+        self.stop()
+        await interaction.response.defer()
+        with contextlib.suppress(discord.HTTPException):
+            await interaction.message.delete()
+
+    @discord.ui.button(emoji="\N{BLACK RIGHTWARDS ARROW}", row=1)
+    async def next(self, interaction: discord.Interaction, _):
+        self.page = (self.page + 1) % self.pages
+        await self.show(interaction)
@@ -29,6 +29,8 @@ class TTSChannelMixin(MixinMeta):
         if channel.id not in channel_list:
             channel_list.append(channel.id)
             await self.config.guild(ctx.guild).channels.set(channel_list)
+            self.config_cache.update_guild(ctx.guild.id, channels=channel_list)
+            self.tts_channels.setdefault(ctx.guild.id, set()).add(channel.id)
             await ctx.send(
                 f"Okay, {channel.mention} will now be used as a TTS channel."
             )
@@ -46,6 +48,8 @@ class TTSChannelMixin(MixinMeta):
         if channel.id in channel_list:
             channel_list.remove(channel.id)
             await self.config.guild(ctx.guild).channels.set(channel_list)
+            self.config_cache.update_guild(ctx.guild.id, channels=channel_list)
+            self.tts_channels.get(ctx.guild.id, set()).discard(channel.id)
             await ctx.send(f"Okay, {channel.mention} is no longer a TTS channel.")
         else:
             await ctx.send(
@@ -74,6 +78,8 @@ class TTSChannelMixin(MixinMeta):
                 return
             if predictate.result:
                 await self.config.guild(ctx.guild).channels.clear()
+                self.config_cache.update_guild(ctx.guild.id, channels=[])
+                self.tts_channels.pop(ctx.guild.id, None)
                 await ctx.send("Okay, I've cleared all TTS channels for this server.")
             else:
                 await ctx.send("Okay, I won't clear any TTS channels.")
@@ -111,21 +117,22 @@ class TTSChannelMixin(MixinMeta):
         Listens for messages to be sent and checks if they are
         eligible to be spoken through TTS channels.
         """
+        if not message.guild or message.author.bot:
+            return
+        if message.channel.id not in self.tts_channels.get(message.guild.id, ()):
+            return
+        # Users with AutoTTS on are already spoken by the AutoTTS listener
+        if message.author.id in self.autotts.get(message.guild.id, ()):
+            return
+
         if (
-            not message.guild
-            or message.author.bot
-            or not message.channel.permissions_for(message.guild.me).send_messages
+            not message.channel.permissions_for(message.guild.me).send_messages
             or not await self.bot.allowed_by_whitelist_blacklist(who=message.author)
             or await self.bot.cog_disabled_in_guild(self, message.guild)
-            or message.author.id not in self.autotts
             or not await self.can_tts(message)
         ):
             return
 
-        guild_config = await self.config.guild(message.guild).all()
-        if message.channel.id not in guild_config["channels"]:
-            return
-
         if not message.author.voice or not message.author.voice.channel:
             await message.channel.send("You are not connected to a voice channel.")
             return
@@ -136,14 +143,22 @@ class TTSChannelMixin(MixinMeta):
             )
             return
 
-        text = await self.process_text(
-            message.guild, message.author, message.clean_content
-        )
+        author, channel = message.author, message.channel
+
+        async def speak(text: str):
+            if not author.voice or not author.voice.channel:
+                return
+            text = await self.process_text(channel.guild, author, text)
+            prefix = await self.name_prefix(channel.guild, author)
+            await self.play_tts(
+                author, author.voice.channel, channel, "ttschannel", text, prefix
+            )
 
-        await self.play_tts(
-            message.author,
-            message.author.voice.channel,
-            message.channel,
-            "ttschannel",
-            text,
+        guild_config = await self.config_cache.guild(message.guild)
+        self.coalescer.add(
+            (message.guild.id, author.id),
+            message.clean_content,
+            speak,
+            guild_config["coalesce_window"],
+            guild_config["coalesce_max_length"],
         )
@@ -0,0 +1,51 @@
+import re
+from typing import List
+
+SENTENCE_RE = re.compile(r"(?<=[.!?\N{HORIZONTAL ELLIPSIS}])\s+")
+CLAUSE_RE = re.compile(r"(?<=[,;:)\N{EM DASH}])\s+")
+
+
+def _pieces(text: str, max_length: int) -> List[str]:
+    """
+    Breaks text into pieces no longer than max_length, at the best boundary available.
+    """
+    pieces = []
+    for sentence in SENTENCE_RE.split(text):
+        if len(sentence) <= max_length:
+            pieces.append(sentence)
+            continue
+        for clause in CLAUSE_RE.split(sentence):
+            if len(clause) <= max_length:
+                pieces.append(clause)
+                continue
+            for word in clause.split():
+                while len(word) > max_length:
+                    pieces.append(word[:max_length])
+                    word = word[max_length:]
+                pieces.append(word)
+    return [piece for piece in pieces if piece]
+
+
+def split_text(text: str, max_length: int = 300, first_length: int = 100) -> List[str]:
+    """
+    Splits text into chunks that can be rendered separately, at sentence or clause boundaries.
+
+    Pieces are packed into chunks of up to max_length characters. The first chunk is
+    kept to first_length so it renders quickly and playback can start sooner.
+    """
+    text = " ".join(text.split())
+    if len(text) <= first_length:
+        return [text] if text else []
+
+    chunks = []
+    current = ""
+    for piece in _pieces(text, max_length):
+        limit = first_length if not chunks else max_length
+        if current and len(current) + 1 + len(piece) > limit:
+            chunks.append(current)
+            current = piece
+        else:
+            current = f"{current} {piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
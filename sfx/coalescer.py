@@ -0,0 +1,118 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional
+
+log = logging.getLogger("red.kao.sfx")
+
+Flush = Callable[[str], Awaitable[None]]
+
+
+class _Buffer:
+    __slots__ = ("parts", "length", "flush", "timer")
+
+    def __init__(self, flush: Flush):
+        self.parts: List[str] = []
+        self.length = 0
+        self.flush = flush
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class MessageCoalescer:
+    """
+    Merges messages sent in quick succession into a single utterance.
+
+    Each key (usually a user in a guild) has a buffer that's flushed once no new
+    message has arrived within the window, or when adding a message would make it
+    longer than the maximum length. Flushes for the same key always run in order.
+    """
+
+    def __init__(self):
+        self._buffers: Dict[Hashable, _Buffer] = {}
+        self._flushing: Dict[Hashable, asyncio.Task] = {}
+
+    @staticmethod
+    def join(parts: List[str]) -> str:
+        """
+        Joins messages so each one is spoken as its own sentence.
+        """
+        if len(parts) == 1:
+            return parts[0]
+        return " ".join(
+            part if part[-1] in ".!?,;:" else f"{part}." for part in parts if part
+        )
+
+    def add(
+        self,
+        key: Hashable,
+        text: str,
+        flush: Flush,
+        window: float,
+        max_length: int,
+    ) -> None:
+        """
+        Adds a message to a key's buffer.
+
+        The flush coroutine function is called with the merged text. The one passed with
+        the latest message is used, so it should use that message's context.
+        """
+        text = text.strip()
+        if not text:
+            return
+
+        buffer = self._buffers.get(key)
+        if buffer and buffer.length + len(text) > max_length:
+            self._flush(key)
+            buffer = None
+
+        if buffer is None:
+            buffer = self._buffers[key] = _Buffer(flush)
+
+        buffer.parts.append(text)
+        buffer.length += len(text) + 1
+        buffer.flush = flush
+
+        if buffer.timer:
+            buffer.timer.cancel()
+        if window <= 0 or buffer.length >= max_length:
+            self._flush(key)
+        else:
+            buffer.timer = asyncio.get_running_loop().call_later(
+                window, self._flush, key
+            )
+
+    def _flush(self, key: Hashable) -> None:
+        buffer = self._buffers.pop(key, None)
+        if not buffer:
+            return
+        if buffer.timer:
+            buffer.timer.cancel()
+
+        previous = self._flushing.get(key)
+        task = asyncio.create_task(
+            self._run(key, previous, buffer.flush, self.join(buffer.parts))
+        )
+        self._flushing[key] = task
+
+    async def _run(
+        self, key: Hashable, previous: Optional[asyncio.Task], flush: Flush, text: str
+    ) -> None:
+        try:
+            if previous:
+                await asyncio.gather(previous, return_exceptions=True)
+            await flush(text)
+        except Exception:
+            log.exception("Error speaking coalesced messages")
+        finally:
+            if self._flushing.get(key) is asyncio.current_task():
+                del self._flushing[key]
+
+    def cancel(self) -> None:
+        """
+        Drops every pending buffer. Used when the cog is unloaded.
+        """
+        for buffer in self._buffers.values():
+            if buffer.timer:
+                buffer.timer.cancel()
+        self._buffers.clear()
+        for task in self._flushing.values():
+            task.cancel()
@@ -1,16 +1,15 @@
 import argparse
-import asyncio
 import io
-from typing import Any, List
 
 import discord
 from redbot.core import commands
 from redbot.core.commands import BadArgument, Context, Converter
 from redbot.core.utils.chat_formatting import escape
-from redbot.core.utils.menus import DEFAULT_CONTROLS, menu
-from thefuzz import process
 
 from .abc import MixinMeta
+from .catalog import VoiceCatalogView
+from .freesound import FreesoundError
+from .ratelimit import RateLimited
 
 
 class NoExitParser(argparse.ArgumentParser):
@@ -19,13 +18,6 @@ class NoExitParser(argparse.ArgumentParser):
 
 
 class TTSConverter(Converter):
-    def divide_chunks(self, list: List[Any], n: int):
-        """
-        Divides a list into chunks of size n.
-        """
-        for i in range(0, len(list), n):
-            yield list[i : i + n]
-
     async def convert(self, ctx: Context, argument: str) -> int:
         """
         The tts command as a large amount of arguments, so a
@@ -37,7 +29,7 @@ class TTSConverter(Converter):
         # this reverts it so the parser works correctly
         argument = argument.replace("—", "--")
 
-        user_config = await ctx.cog.config.user(ctx.author).all()
+        user_config = await ctx.cog.config_cache.user(ctx.author)
 
         parser = NoExitParser(add_help=False)
         parser.add_argument("text", type=str, nargs="*")
@@ -68,52 +60,34 @@ class TTSConverter(Converter):
 
         values["text"] = " ".join(values["text"])
 
-        voices_list = [voice["name"] for voice in ctx.cog.voices]
+        voice_index = ctx.cog.voice_index
 
-        if user_config["voice"] not in voices_list:
+        if voice_index and not voice_index.get(user_config["voice"]):
             await ctx.cog.config.user(ctx.author).voice.clear()
+            ctx.cog.config_cache.invalidate_user(ctx.author.id)
 
-        if values["voice"] not in voices_list:
-            values["voice"] = process.extract(
-                " ".join(values["voice"]),
-                voices_list,
-                limit=1,
-            )[0][0]
+        if isinstance(values["voice"], list):
+            values["voice"] = " ".join(values["voice"])
+
+        voice = voice_index.match(values["voice"])
+        if voice:
+            values["voice"] = voice["name"]
 
         if values["voices"]:
-            pages = []
-            divided = self.divide_chunks(ctx.cog.voices, 12)
-            if not divided:
+            catalog = ctx.cog.voice_catalog
+            if not catalog.index:
                 await ctx.send(
                     "Something is going wrong with the TTS API, please try again later."
                 )
                 return
 
-            for chunk in divided:
-                embed = discord.Embed(color=await ctx.embed_color())
-                for voice in chunk:
-                    url = ctx.cog.generate_url(
-                        voice["name"],
-                        False,
-                        f"Hi, I'm {voice['name']}, nice to meet you.",
-                        1.0,
-                        "mp3",
-                    )
-                    m = f"""
-                    Example: [Click Here]({url})
-                    • Gender: {voice['gender']}
-                    • Language: {voice['language']['name']}
-                    • Source: {voice['source']}
-                    """
-                    embed.add_field(name=voice["name"], value=m)
-                pages.append(embed)
-
-            for index, embed in enumerate(pages):
-                embed.set_footer(
-                    text=f"Page {index + 1}/{len(pages)} | {len(ctx.cog.voices)} voices"
-                )
+            voices = catalog.voices(catalog.parse_filters(values["text"].split()))
+            if not voices:
+                await ctx.send("There aren't any voices that match those filters.")
+                return
 
-            asyncio.create_task(menu(ctx, pages, DEFAULT_CONTROLS))
+            view = VoiceCatalogView(ctx, catalog, voices, await ctx.embed_color())
+            await view.start()
             return
 
         return values
@@ -136,7 +110,7 @@ class BaseCommandsMixin(MixinMeta):
             `--download`: Whether to download the file instead of playing it.
             `--translate`: Whether to translate the text to the voice language. Use `--no-translate` if your default is `True`.
 
-            `--voices`: Lists all available voices. Cannot be used with other arguments.
+            `--voices`: Lists all available voices. Cannot be used with other arguments, but can be filtered with `language:<code or name>` and `gender:<gender>`.
         """
         if not args:
             return
@@ -165,16 +139,10 @@ class BaseCommandsMixin(MixinMeta):
                 return
 
             args["text"] = await self.process_text(ctx.guild, ctx.author, args["text"])
-
-        url = self.generate_url(
-            args["voice"],
-            args["translate"],
-            args["text"],
-            args["speed"],
-            # MP3 is more widely supported (for downloading)
-            # but Opus doesn't need to be transcoded with Lavalink
-            "mp3" if args["download"] else "ogg_opus",
-        )
+            if not args["text"]:
+                await ctx.send("There's nothing left to say once that's cleaned up.")
+                return
+            prefix = await self.name_prefix(ctx.guild, ctx.author)
 
         if args["download"]:
             if not ctx.channel.permissions_for(ctx.guild.me).attach_files:
@@ -183,32 +151,56 @@ class BaseCommandsMixin(MixinMeta):
                 )
                 return
 
-            async with self.session.get(url) as resp:
-                if resp.status != 200:
-                    await ctx.send("Something went wrong. Try again later.")
-                    return
-                data = await resp.read()
-                f = io.BytesIO(data)
-                f.seek(0)
+            # MP3 is more widely supported (for downloading)
+            # but Opus doesn't need to be transcoded with Lavalink
+            try:
+                path = await self.get_tts_audio(
+                    args["voice"],
+                    args["translate"],
+                    args["text"],
+                    args["speed"],
+                    "mp3",
+                    ctx.guild.id,
+                )
+            except RateLimited:
                 await ctx.send(
-                    content="Here's your TTS file!",
-                    file=discord.File(fp=f, filename="tts.mp3"),
+                    "There's too much TTS being rendered right now, please try again in a bit."
                 )
                 return
+            if not path:
+                await ctx.send("Something went wrong. Try again later.")
+                return
 
+            await ctx.send(
+                content="Here's your TTS file!",
+                file=discord.File(fp=str(path), filename="tts.mp3"),
+            )
+            return
+
+        source, url = self.tts_source(
+            args["voice"],
+            args["translate"],
+            args["text"],
+            args["speed"],
+            prefix,
+            ctx.guild.id,
+        )
         track_info = ("Text to Speech", ctx.author)
         await self.play_sound(
             ctx.author.voice.channel,
             ctx.channel,
             "tts",
-            url,
+            source,
             track_info,
+            fallback_url=url,
         )
 
     async def sfx_check(ctx) -> bool:
         """
-        Checks if the user has a Freesound API key set.
+        Checks if the bot has sounds in the local library or a Freesound API key set.
         """
+        if ctx.cog.library:
+            return True
         token = await ctx.bot.get_shared_api_tokens("freesound")
         if token.get("id") and token.get("key"):
             return True
@@ -224,7 +216,7 @@ class BaseCommandsMixin(MixinMeta):
         """
         Plays a sound effect in your current voice channel.
 
-        Sounds are found on https://freesound.org
+        Sounds are found in the bot's local library first, and then on https://freesound.org
         """
 
         if "--download" not in sound:
@@ -251,45 +243,39 @@ class BaseCommandsMixin(MixinMeta):
                 return
 
         async with ctx.typing():
-            headers = {"Authorization": "Token " + self.key}
-            async with self.session.get(
-                f"{self.SFX_API_URL}/search/text/",
-                params={
-                    "query": sound.replace("--download", ""),
-                    "filter": "duration:[0.5 TO 15]",
-                },
-                headers=headers,
-            ) as resp:
-                if resp.status != 200:
+            query = sound.replace("--download", "")
+            local = self.library.search(query)
+
+            if local:
+                path = self.library.file(local)
+                name = escape(local["name"], formatting=True)[:100]
+            elif self.key:
+                path = None
+                try:
+                    data = await self.freesound.search(query, self.key, ctx.guild.id)
+                except RateLimited:
+                    await ctx.send(
+                        "Too many sounds are being looked up right now, please try again in a bit."
+                    )
+                    return
+                except FreesoundError:
                     await ctx.send(
                         "Something went wrong when searching for the sound. Please try again later."
                     )
                     return
 
-                data = await resp.json()
-                results = data["results"]
-
-                if not results:
+                if not data:
                     await ctx.send("No sounds found for your query.")
                     return
 
-                sound_id = results[0]["id"]
-
-            async with self.session.get(
-                f"{self.SFX_API_URL}/sounds/{sound_id}/", headers=headers
-            ) as resp:
-                if resp.status != 200:
-                    await ctx.send(
-                        "Something went wrong when getting the sound. Please try again later."
-                    )
-                    return
-
-                data = await resp.json()
-                url = data["previews"]["preview-hq-mp3"]
+                name = data["name"]
+                if data["type"] and name.endswith(f".{data['type']}"):
+                    name = name[: -len(data["type"]) - 1]
+                name = escape(name, formatting=True)[:100]
+            else:
+                await ctx.send("No sounds found for your query.")
+                return
 
-            name = escape(data["name"].split(f".{data['type']}")[0], formatting=True)[
-                :100
-            ]
             track_info = (name, ctx.author)
 
             if "--download" in sound:
@@ -301,7 +287,13 @@ class BaseCommandsMixin(MixinMeta):
                         "I do not have permissions to send files in this channel."
                     )
                     return
-                async with self.session.get(url) as resp:
+                if path:
+                    await ctx.send(
+                        content=f"Here's '{name}'!",
+                        file=discord.File(str(path), filename=f"{name}{path.suffix}"),
+                    )
+                    return
+                async with self.session.get(data["preview"]) as resp:
                     if resp.status != 200:
                         await ctx.send("Something went wrong. Try again later.")
                         return
@@ -318,7 +310,7 @@ class BaseCommandsMixin(MixinMeta):
                 ctx.author.voice.channel,
                 ctx.channel,
                 "sfx",
-                url,
+                self.local_url(path) if path else data["preview"],
                 track_info,
             )
 
@@ -331,6 +323,7 @@ class BaseCommandsMixin(MixinMeta):
         """
         current = await self.config.guild(ctx.guild).say_name()
         await self.config.guild(ctx.guild).say_name.set(not current)
+        self.config_cache.update_guild(ctx.guild.id, say_name=not current)
 
         if current:
             await ctx.send("I will no longer say the author's name in TTS.")
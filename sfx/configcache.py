@@ -0,0 +1,106 @@
+import time
+from typing import Any, Dict
+
+import discord
+from redbot.core import Config
+
+
+class ConfigCache:
+    """
+    An in-memory snapshot of guild and user settings, so event listeners don't
+    need to read from Config every time they run.
+
+    Settings are loaded lazily, updated in place by the commands that change them,
+    and dropped once they haven't been used for a while.
+
+    The returned dicts are shared, so they must not be modified by callers.
+    """
+
+    def __init__(self, config: Config, idle_timeout: float = 3600):
+        self.config = config
+        self.idle_timeout = idle_timeout
+        self._guilds: Dict[int, Dict[str, Any]] = {}
+        self._users: Dict[int, Dict[str, Any]] = {}
+        self._guild_access: Dict[int, float] = {}
+        self._user_access: Dict[int, float] = {}
+        # Bumped on every write so a load that raced a write isn't stored
+        self._generation = 0
+
+    async def guild(self, guild: discord.Guild) -> Dict[str, Any]:
+        """
+        Gets all the settings for a guild.
+        """
+        data = self._guilds.get(guild.id)
+        if data is None:
+            generation = self._generation
+            data = await self.config.guild(guild).all()
+            if generation == self._generation:
+                self._guilds[guild.id] = data
+        self._guild_access[guild.id] = time.monotonic()
+        return data
+
+    async def user(self, user: discord.abc.User) -> Dict[str, Any]:
+        """
+        Gets all the settings for a user.
+        """
+        data = self._users.get(user.id)
+        if data is None:
+            generation = self._generation
+            data = await self.config.user(user).all()
+            if generation == self._generation:
+                self._users[user.id] = data
+        self._user_access[user.id] = time.monotonic()
+        return data
+
+    def update_guild(self, guild_id: int, **values: Any) -> None:
+        """
+        Updates a guild's cached settings after they've been saved to Config.
+        """
+        self._generation += 1
+        if guild_id in self._guilds:
+            self._guilds[guild_id].update(values)
+
+    def update_user(self, user_id: int, **values: Any) -> None:
+        """
+        Updates a user's cached settings after they've been saved to Config.
+        """
+        self._generation += 1
+        if user_id in self._users:
+            self._users[user_id].update(values)
+
+    def invalidate_guild(self, guild_id: int) -> None:
+        """
+        Drops a guild's cached settings so they're reloaded next time.
+        """
+        self._generation += 1
+        self._guilds.pop(guild_id, None)
+        self._guild_access.pop(guild_id, None)
+
+    def invalidate_user(self, user_id: int) -> None:
+        """
+        Drops a user's cached settings so they're reloaded next time.
+        """
+        self._generation += 1
+        self._users.pop(user_id, None)
+        self._user_access.pop(user_id, None)
+
+    def evict_idle(self) -> int:
+        """
+        Drops every entry that hasn't been used within the idle timeout.
+
+        Returns how many entries were dropped.
+        """
+        cutoff = time.monotonic() - self.idle_timeout
+        evicted = 0
+        for cache, access in (
+            (self._guilds, self._guild_access),
+            (self._users, self._user_access),
+        ):
+            for key in [k for k, t in access.items() if t < cutoff]:
+                cache.pop(key, None)
+                del access[key]
+                evicted += 1
+        return evicted
+
+    def __len__(self) -> int:
+        return len(self._guilds) + len(self._users)
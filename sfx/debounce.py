@@ -0,0 +1,75 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Hashable, Optional
+
+log = logging.getLogger("red.kao.sfx")
+
+Play = Callable[[], Awaitable[None]]
+
+
+class _Burst:
+    __slots__ = ("pending", "task")
+
+    def __init__(self):
+        self.pending: Optional[Play] = None
+        self.task: Optional[asyncio.Task] = None
+
+
+class EventDebouncer:
+    """
+    Turns bursts of events into a few sounds.
+
+    The first event for a key (usually a channel and join or leave) plays right away.
+    Events that arrive in the window after a sound are held, and only the latest one
+    is played when the window ends. On top of that, a guild never plays more than
+    one sound per interval, across all of its keys.
+    """
+
+    def __init__(self, window: float = 3, interval: float = 1.5):
+        self.window = window
+        self.interval = interval
+        self.skipped = 0
+        self._bursts: Dict[Hashable, _Burst] = {}
+        self._next_play: Dict[int, float] = {}
+
+    def add(self, key: Hashable, guild_id: int, play: Play) -> None:
+        """
+        Adds an event. Its play coroutine function is called unless a newer event replaces it.
+        """
+        burst = self._bursts.get(key)
+        if burst is None:
+            burst = self._bursts[key] = _Burst()
+            burst.task = asyncio.create_task(self._run(key, guild_id, burst))
+        elif burst.pending:
+            self.skipped += 1
+        burst.pending = play
+
+    async def _run(self, key: Hashable, guild_id: int, burst: _Burst) -> None:
+        try:
+            while burst.pending:
+                wait = self._next_play.get(guild_id, 0) - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+
+                play, burst.pending = burst.pending, None
+                self._next_play[guild_id] = time.monotonic() + self.interval
+                try:
+                    await play()
+                except Exception:
+                    log.exception("Error playing a join or leave sound")
+
+                await asyncio.sleep(self.window)
+        finally:
+            if self._bursts.get(key) is burst:
+                del self._bursts[key]
+            if self._next_play.get(guild_id, 0) < time.monotonic():
+                self._next_play.pop(guild_id, None)
+
+    def cancel(self) -> None:
+        """
+        Drops every pending event. Used when the cog is unloaded.
+        """
+        for burst in self._bursts.values():
+            burst.task.cancel()
+        self._bursts.clear()
@@ -0,0 +1,158 @@
+import asyncio
+from typing import Dict, Optional
+
+import aiohttp
+
+from .ratelimit import RateLimiter, retry_after
+from .ttlcache import TTLCache
+
+
+class FreesoundError(Exception):
+    """
+    Raised when the Freesound API can't be reached or returns an error.
+    """
+
+
+class FreesoundClient:
+    """
+    Looks up sounds on Freesound, caching results to save API quota.
+
+    Searches ask for the fields we need directly, so a lookup is a single request.
+    Queries with no results are cached for a shorter time, and identical queries
+    that are in flight at the same time share one request. Requests are paced by the
+    limiter, and a 429 pauses it for as long as Freesound asks.
+    """
+
+    FIELDS = "id,name,type,previews"
+    FILTER = "duration:[0.5 TO 15]"
+
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        api_url: str,
+        ttl: float = 86400,
+        negative_ttl: float = 600,
+        limiter: Optional[RateLimiter] = None,
+    ):
+        self.session = session
+        self.api_url = api_url
+        self.limiter = limiter
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._queries = TTLCache(2048)
+        self._previews = TTLCache(2048)
+        self._in_flight: Dict[str, asyncio.Task] = {}
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        return " ".join(query.casefold().split())
+
+    async def search(
+        self, query: str, key: str, guild_id: Optional[int] = None
+    ) -> Optional[dict]:
+        """
+        Finds the best sound for a query.
+
+        Returns a dict with the sound's id, name, type and preview URL, or None if nothing was found.
+        Raises FreesoundError if the API request failed, or RateLimited if it couldn't be made in time.
+        """
+        query = self.normalize(query)
+        if query in self._queries:
+            self.hits += 1
+            return self._queries.get(query)
+
+        task = self._in_flight.get(query)
+        if not task:
+            self.misses += 1
+            task = asyncio.create_task(self._search(query, key, guild_id))
+            self._in_flight[query] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(query, None))
+
+        return await asyncio.shield(task)
+
+    async def _get(
+        self,
+        path: str,
+        key: str,
+        params: Optional[dict] = None,
+        guild_id: Optional[int] = None,
+    ) -> dict:
+        if self.limiter:
+            await self.limiter.acquire(guild_id)
+        try:
+            async with self.session.get(
+                f"{self.api_url}{path}",
+                params=params,
+                headers={"Authorization": f"Token {key}"},
+            ) as resp:
+                if resp.status == 429 and self.limiter:
+                    self.limiter.pause(retry_after(resp.headers))
+                if resp.status != 200:
+                    raise FreesoundError(f"Freesound returned {resp.status}")
+                return await resp.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            raise FreesoundError(str(e)) from e
+
+    async def _search(
+        self, query: str, key: str, guild_id: Optional[int]
+    ) -> Optional[dict]:
+        data = await self._get(
+            "/search/text/",
+            key,
+            {
+                "query": query,
+                "filter": self.FILTER,
+                "fields": self.FIELDS,
+                "page_size": 1,
+            },
+            guild_id,
+        )
+        results = data.get("results")
+        if not results:
+            self._queries.set(query, None, self.negative_ttl)
+            return None
+
+        result = results[0]
+        preview = (result.get("previews") or {}).get("preview-hq-mp3")
+        if not preview or "name" not in result:
+            # The fields parameter wasn't honoured, so look the sound up directly
+            result = await self.sound(result["id"], key, guild_id)
+            preview = result["preview"]
+
+        sound = {
+            "id": result["id"],
+            "name": result["name"],
+            "type": result.get("type", ""),
+            "preview": preview,
+        }
+        self._queries.set(query, sound, self.ttl)
+        self._previews.set(sound["id"], sound, self.ttl)
+        return sound
+
+    async def sound(
+        self, sound_id: int, key: str, guild_id: Optional[int] = None
+    ) -> dict:
+        """
+        Gets a sound's id, name, type and preview URL by its id.
+        """
+        sound = self._previews.get(sound_id)
+        if sound:
+            self.hits += 1
+            return sound
+
+        self.misses += 1
+        data = await self._get(f"/sounds/{sound_id}/", key, guild_id=guild_id)
+        sound = {
+            "id": data["id"],
+            "name": data["name"],
+            "type": data.get("type", ""),
+            "preview": data["previews"]["preview-hq-mp3"],
+        }
+        self._previews.set(sound_id, sound, self.ttl)
+        return sound
+
+    def clear(self) -> None:
+        self._queries.clear()
+        self._previews.clear()
@@ -0,0 +1,57 @@
+import random
+import time
+from typing import Optional
+
+
+class HealthTracker:
+    """
+    Tracks whether a remote service is working and when it's worth trying again.
+
+    Consecutive failures back off exponentially, with some jitter so retries
+    don't line up.
+    """
+
+    def __init__(self, base: float = 5, maximum: float = 1800):
+        self.base = base
+        self.maximum = maximum
+        self.failures = 0
+        self.retry_at = 0.0
+
+    @property
+    def healthy(self) -> bool:
+        return self.failures == 0
+
+    @property
+    def available(self) -> bool:
+        """
+        Whether the backoff period after the last failure has passed.
+        """
+        return time.monotonic() >= self.retry_at
+
+    @property
+    def retry_in(self) -> float:
+        """
+        How many seconds are left until the backoff period passes.
+        """
+        return max(self.retry_at - time.monotonic(), 0.0)
+
+    def delay(self) -> float:
+        """
+        How long to wait before trying again, in seconds.
+        """
+        if not self.failures:
+            return 0.0
+        delay = min(self.base * 2 ** (self.failures - 1), self.maximum)
+        return delay * random.uniform(0.8, 1.2)
+
+    def success(self) -> None:
+        self.failures = 0
+        self.retry_at = 0.0
+
+    def failure(self, retry_after: Optional[float] = None) -> None:
+        """
+        Records a failure. If the service said when to retry, that's respected instead.
+        """
+        self.failures += 1
+        delay = retry_after if retry_after is not None else self.delay()
+        self.retry_at = time.monotonic() + delay
@@ -5,6 +5,7 @@ from redbot.core import commands
 from redbot.core.commands import Context
 
 from .abc import MixinMeta
+from .store import InvalidSound
 
 
 class JoinAndLeaveMixin(MixinMeta):
@@ -20,183 +21,103 @@ class JoinAndLeaveMixin(MixinMeta):
         """
         if user.bot:
             return
+
+        if before.channel is None and after.channel:
+            kind, channel = "join", after.channel
+        elif before.channel and after.channel is None:
+            kind, channel = "leave", before.channel
+        else:
+            return
+
         if await self.bot.allowed_by_whitelist_blacklist(who=user) is False:
             return
         if await self.bot.cog_disabled_in_guild(self, user.guild):
             return
 
-        guild_config = await self.config.guild(user.guild).all()
+        guild_config = await self.config_cache.guild(user.guild)
         if not guild_config["allow_join_and_leave"]:
             return
         if user.id in guild_config["disabled_users"]:
             return
 
-        user_config = await self.config.user(user).all()
+        user_config = await self.config_cache.user(user)
 
         # Check the priority setting
-        if guild_config["priority"] == "guild":
-            # Play guild sounds if available, otherwise play user sounds
-            if guild_config["join_sound"] and before.channel is None and after.channel:
-                current_perms = after.channel.permissions_for(user.guild.me)
-                if not current_perms.speak or not current_perms.connect:
-                    return
-
-                if user.guild.me and user.guild.me.voice:
-                    if after.channel != user.guild.me.voice.channel:
-                        return
-
-                track_info = ("Join Sound", user)
-
-                await self.play_sound(
-                    after.channel,
-                    None,
-                    "joinleave",
-                    guild_config["join_sound"],
-                    track_info,
-                )
-                return
-            elif (
-                guild_config["leave_sound"] and before.channel and after.channel is None
-            ):
-                current_perms = before.channel.permissions_for(user.guild.me)
-                if not current_perms.speak or not current_perms.connect:
-                    return
-
-                if user.guild.me and user.guild.me.voice:
-                    if before.channel != user.guild.me.voice.channel:
-                        return
-
-                track_info = ("Leave Sound", user)
-                await self.play_sound(
-                    before.channel,
-                    None,
-                    "joinleave",
-                    guild_config["leave_sound"],
-                    track_info,
-                )
-                return
-            elif user_config["join_sound"] and before.channel is None and after.channel:
-                current_perms = after.channel.permissions_for(user.guild.me)
-                if not current_perms.speak or not current_perms.connect:
-                    return
-
-                if user.guild.me and user.guild.me.voice:
-                    if after.channel != user.guild.me.voice.channel:
-                        return
-
-                track_info = ("Join Sound", user)
-
-                await self.play_sound(
-                    after.channel,
-                    None,
-                    "joinleave",
-                    user_config["join_sound"],
-                    track_info,
-                )
-                return
-            elif (
-                user_config["leave_sound"] and before.channel and after.channel is None
-            ):
-                current_perms = before.channel.permissions_for(user.guild.me)
-                if not current_perms.speak or not current_perms.connect:
-                    return
-
-                if user.guild.me and user.guild.me.voice:
-                    if before.channel != user.guild.me.voice.channel:
-                        return
-
-                track_info = ("Leave Sound", user)
-                await self.play_sound(
-                    before.channel,
-                    None,
-                    "joinleave",
-                    user_config["leave_sound"],
-                    track_info,
-                )
-                return
+        sources = [
+            ("guild", user.guild.id, guild_config),
+            ("user", user.id, user_config),
+        ]
+        if guild_config["priority"] == "user":
+            sources.reverse()
+
+        for scope, owner_id, conf in sources:
+            if conf[f"{kind}_sound"]:
+                url = conf[f"{kind}_sound"]
+                break
         else:
-            # Play user sounds if available, otherwise play guild sounds
-            if user_config["join_sound"] and before.channel is None and after.channel:
-                current_perms = after.channel.permissions_for(user.guild.me)
-                if not current_perms.speak or not current_perms.connect:
-                    return
-
-                if user.guild.me and user.guild.me.voice:
-                    if after.channel != user.guild.me.voice.channel:
-                        return
-
-                track_info = ("Join Sound", user)
-
-                await self.play_sound(
-                    after.channel,
-                    None,
-                    "joinleave",
-                    user_config["join_sound"],
-                    track_info,
-                )
-                return
-            elif (
-                user_config["leave_sound"] and before.channel and after.channel is None
-            ):
-                current_perms = before.channel.permissions_for(user.guild.me)
-                if not current_perms.speak or not current_perms.connect:
-                    return
-
-                if user.guild.me and user.guild.me.voice:
-                    if before.channel != user.guild.me.voice.channel:
-                        return
-
-                track_info = ("Leave Sound", user)
-                await self.play_sound(
-                    before.channel,
-                    None,
-                    "joinleave",
-                    user_config["leave_sound"],
-                    track_info,
-                )
-                return
-            elif (
-                guild_config["join_sound"] and before.channel is None and after.channel
-            ):
-                current_perms = after.channel.permissions_for(user.guild.me)
-                if not current_perms.speak or not current_perms.connect:
-                    return
-
-                if user.guild.me and user.guild.me.voice:
-                    if after.channel != user.guild.me.voice.channel:
-                        return
-
-                track_info = ("Join Sound", user)
-
-                await self.play_sound(
-                    after.channel,
-                    None,
-                    "joinleave",
-                    guild_config["join_sound"],
-                    track_info,
-                )
-                return
-            elif (
-                guild_config["leave_sound"] and before.channel and after.channel is None
-            ):
-                current_perms = before.channel.permissions_for(user.guild.me)
-                if not current_perms.speak or not current_perms.connect:
-                    return
-
-                if user.guild.me and user.guild.me.voice:
-                    if before.channel != user.guild.me.voice.channel:
-                        return
-
-                track_info = ("Leave Sound", user)
-                await self.play_sound(
-                    before.channel,
-                    None,
-                    "joinleave",
-                    guild_config["leave_sound"],
-                    track_info,
-                )
+            return
+
+        current_perms = channel.permissions_for(user.guild.me)
+        if not current_perms.speak or not current_perms.connect:
+            return
+
+        if user.guild.me and user.guild.me.voice:
+            if channel != user.guild.me.voice.channel:
                 return
 
+        track_info = (f"{kind.title()} Sound", user)
+
+        path = self.sound_store.get(scope, owner_id, kind)
+        if not path:
+            # This sound was set before sounds were stored locally,
+            # so store it now for next time.
+            self.bot.loop.create_task(self.migrate_sound(scope, owner_id, kind, url))
+
+        async def play():
+            await self.play_sound(
+                channel,
+                None,
+                "joinleave",
+                self.local_url(path) if path else url,
+                track_info,
+                fallback_url=url if path else None,
+                merge_key=(kind, channel.id, url),
+            )
+
+        # When lots of people join or leave at once, only some of their sounds are played
+        self.joinleave_debouncer.add((channel.id, kind), user.guild.id, play)
+
+    async def migrate_sound(
+        self, scope: str, owner_id: int, kind: str, url: str
+    ) -> None:
+        """
+        Stores a sound that was only saved as a URL. Each URL is only tried once.
+        """
+        if url in self.failed_sound_urls:
+            return
+        self.failed_sound_urls.add(url)
+        try:
+            await self.sound_store.save(scope, owner_id, kind, url)
+        except InvalidSound:
+            return
+        self.failed_sound_urls.discard(url)
+
+    async def set_sound(
+        self, ctx: Context, scope: str, owner_id: int, kind: str, url: str
+    ) -> bool:
+        """
+        Downloads and validates a sound before it's saved, so it's only fetched once.
+
+        Returns whether the sound was stored. If not, the user is told why.
+        """
+        async with ctx.typing():
+            try:
+                await self.sound_store.save(scope, owner_id, kind, url)
+            except InvalidSound as e:
+                await ctx.send(str(e))
+                return False
+        return True
+
     @commands.group(aliases=["joinleave"])
     async def joinandleave(self, ctx: Context):
         """Settings for join and leave sounds."""
@@ -219,11 +140,13 @@ class JoinAndLeaveMixin(MixinMeta):
         current_priority = await self.config.guild(ctx.guild).priority()
         if current_priority == "user":
             await self.config.guild(ctx.guild).priority.set("guild")
+            self.config_cache.update_guild(ctx.guild.id, priority="guild")
             await ctx.send(
                 "The priority for join and leave sounds is now set to guild sounds."
             )
         else:
             await self.config.guild(ctx.guild).priority.set("user")
+            self.config_cache.update_guild(ctx.guild.id, priority="user")
             await ctx.send(
                 "The priority for join and leave sounds is now set to user sounds."
             )
@@ -241,10 +164,16 @@ class JoinAndLeaveMixin(MixinMeta):
             attachments = ctx.message.attachments
             if not attachments:
                 await self.config.guild(ctx.guild).join_sound.clear()
+                self.config_cache.invalidate_guild(ctx.guild.id)
+                self.sound_store.delete("guild", ctx.guild.id, "join")
                 return await ctx.send("I've reset this guild's join sound.")
             url = attachments[0].url
 
+        if not await self.set_sound(ctx, "guild", ctx.guild.id, "join", url):
+            return
+
         await self.config.guild(ctx.guild).join_sound.set(url)
+        self.config_cache.update_guild(ctx.guild.id, join_sound=url)
         await ctx.send(
             "I've set the sound that will be played upon everyone joining a voice channel."
         )
@@ -264,10 +193,16 @@ class JoinAndLeaveMixin(MixinMeta):
             attachments = ctx.message.attachments
             if not attachments:
                 await self.config.guild(ctx.guild).leave_sound.clear()
+                self.config_cache.invalidate_guild(ctx.guild.id)
+                self.sound_store.delete("guild", ctx.guild.id, "leave")
                 return await ctx.send("I've reset this guild's leave sound.")
             url = attachments[0].url
 
+        if not await self.set_sound(ctx, "guild", ctx.guild.id, "leave", url):
+            return
+
         await self.config.guild(ctx.guild).leave_sound.set(url)
+        self.config_cache.update_guild(ctx.guild.id, leave_sound=url)
         await ctx.send(
             "I've set the sound that will be played upon everyone leaving a voice channel."
         )
@@ -279,6 +214,7 @@ class JoinAndLeaveMixin(MixinMeta):
         """
         conf = await self.config.guild(ctx.guild).allow_join_and_leave()
         await self.config.guild(ctx.guild).allow_join_and_leave.set(not conf)
+        self.config_cache.update_guild(ctx.guild.id, allow_join_and_leave=not conf)
         await ctx.send(
             "Join and leave sounds will now be played in voice channels."
             if not conf
@@ -296,6 +232,7 @@ class JoinAndLeaveMixin(MixinMeta):
         else:
             disabled_users.append(user.id)
             await self.config.guild(ctx.guild).disabled_users.set(disabled_users)
+            self.config_cache.update_guild(ctx.guild.id, disabled_users=disabled_users)
             await ctx.send(f"{user.mention}'s join/leave sounds have been disabled.")
 
     @joinandleave_guild.command(name="enableuser")
@@ -309,6 +246,7 @@ class JoinAndLeaveMixin(MixinMeta):
         else:
             disabled_users.remove(user.id)
             await self.config.guild(ctx.guild).disabled_users.set(disabled_users)
+            self.config_cache.update_guild(ctx.guild.id, disabled_users=disabled_users)
             await ctx.send(f"{user.mention}'s join/leave sounds have been enabled.")
 
     @joinandleave.command()
@@ -322,10 +260,16 @@ class JoinAndLeaveMixin(MixinMeta):
             attachments = ctx.message.attachments
             if not attachments:
                 await self.config.user(ctx.author).join_sound.clear()
+                self.config_cache.invalidate_user(ctx.author.id)
+                self.sound_store.delete("user", ctx.author.id, "join")
                 return await ctx.send("I've reset your join sound.")
             url = attachments[0].url
 
+        if not await self.set_sound(ctx, "user", ctx.author.id, "join", url):
+            return
+
         await self.config.user(ctx.author).join_sound.set(url)
+        self.config_cache.update_user(ctx.author.id, join_sound=url)
         await ctx.send(
             "I've set your sound that will be played upon you joining a voice channel."
         )
@@ -341,10 +285,16 @@ class JoinAndLeaveMixin(MixinMeta):
             attachments = ctx.message.attachments
             if not attachments:
                 await self.config.user(ctx.author).leave_sound.clear()
+                self.config_cache.invalidate_user(ctx.author.id)
+                self.sound_store.delete("user", ctx.author.id, "leave")
                 return await ctx.send("I've reset your leave sound.")
             url = attachments[0].url
 
-        await self.config.user(ctx.author).join_sound.set(url)
+        if not await self.set_sound(ctx, "user", ctx.author.id, "leave", url):
+            return
+
+        await self.config.user(ctx.author).leave_sound.set(url)
+        self.config_cache.update_user(ctx.author.id, leave_sound=url)
         await ctx.send(
             "I've set your sound that will be played upon you leaving a voice channel."
         )
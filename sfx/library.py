@@ -0,0 +1,150 @@
+import contextlib
+import json
+import os
+import re
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+from rapidfuzz import fuzz, process, utils
+
+TOKEN_RE = re.compile(r"[^\W_]+")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.casefold())
+
+
+class SoundLibrary:
+    """
+    A local library of sound effects that the sfx command searches before Freesound.
+
+    The index is kept in memory and saved as JSON next to the clips. Searches look
+    sounds up by their name and tag tokens, and fall back to fuzzy matching names.
+    """
+
+    # How similar, out of 100, a whole name has to be to the whole query
+    # when not every word of the query matched
+    FUZZY_CUTOFF = 85
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.sounds: Dict[str, dict] = {}
+        self._tokens: Dict[str, Set[str]] = {}
+        self._choices: List[str] = []
+        self._names: List[str] = []
+
+        try:
+            with open(self.path / "index.json") as f:
+                sounds = json.load(f)
+        except (OSError, ValueError):
+            sounds = {}
+
+        for key, sound in sounds.items():
+            if (self.path / sound["file"]).is_file():
+                self.sounds[key] = sound
+        self._rebuild()
+
+    def __len__(self) -> int:
+        return len(self.sounds)
+
+    @staticmethod
+    def key(name: str) -> str:
+        return " ".join(tokenize(name))
+
+    def _rebuild(self) -> None:
+        self._tokens = {}
+        for key, sound in self.sounds.items():
+            for token in set(tokenize(sound["name"])) | set(sound["tags"]):
+                self._tokens.setdefault(token, set()).add(key)
+        self._names = list(self.sounds)
+        self._choices = [utils.default_process(key) for key in self._names]
+
+    def _save(self) -> None:
+        tmp = self.path / "index.json.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.sounds, f)
+        os.replace(tmp, self.path / "index.json")
+
+    def file(self, sound: dict) -> Path:
+        return self.path / sound["file"]
+
+    def get(self, name: str) -> Optional[dict]:
+        return self.sounds.get(self.key(name))
+
+    def add(
+        self, name: str, path: Path, tags: List[str], duration: Optional[float]
+    ) -> dict:
+        """
+        Adds a clip that's already in the library folder to the index.
+        """
+        key = self.key(name)
+        old = self.sounds.get(key)
+        if old and old["file"] != path.name:
+            with contextlib.suppress(FileNotFoundError):
+                self.file(old).unlink()
+
+        sound = {
+            "name": name,
+            "file": path.name,
+            "tags": sorted({token for tag in tags for token in tokenize(tag)}),
+            "duration": duration,
+        }
+        self.sounds[key] = sound
+        self._rebuild()
+        self._save()
+        return sound
+
+    def remove(self, name: str) -> bool:
+        sound = self.sounds.pop(self.key(name), None)
+        if not sound:
+            return False
+        with contextlib.suppress(FileNotFoundError):
+            self.file(sound).unlink()
+        self._rebuild()
+        self._save()
+        return True
+
+    def search(self, query: str) -> Optional[dict]:
+        """
+        Finds the sound that best matches a query, or None if nothing matches well.
+
+        Every word of the query has to be in a sound's name or tags. If no sound has them all,
+        the closest name is used if the whole name is similar enough to the whole query, such
+        as a typo. A name that's only part of the query doesn't count, so those queries go
+        to Freesound instead.
+        """
+        tokens = tokenize(query)
+        if not tokens or not self.sounds:
+            return None
+
+        exact = self.sounds.get(" ".join(tokens))
+        if exact:
+            return exact
+
+        candidates = None
+        for token in tokens:
+            keys = self._tokens.get(token, set())
+            candidates = keys if candidates is None else candidates & keys
+            if not candidates:
+                break
+
+        if candidates:
+            # Prefer the sound whose name is closest to the query
+            return self.sounds[
+                max(
+                    candidates,
+                    key=lambda key: (fuzz.ratio(key, " ".join(tokens)), key),
+                )
+            ]
+
+        result = process.extractOne(
+            utils.default_process(query),
+            self._choices,
+            scorer=fuzz.token_sort_ratio,
+            processor=None,
+            score_cutoff=self.FUZZY_CUTOFF,
+        )
+        if result:
+            return self.sounds[self._names[result[2]]]
+        return None
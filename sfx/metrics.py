@@ -0,0 +1,178 @@
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# The stages of an utterance, in the order they happen
+STAGES = ("can_tts", "config", "queue", "render", "load_tracks", "start")
+
+# Bucket upper bounds in seconds, from 1 ms to 60 s, each 25% wider than the last
+BUCKETS: Tuple[float, ...] = tuple(0.001 * 1.25**i for i in range(50))
+
+
+class LatencyHistogram:
+    """
+    Counts durations in fixed buckets, so recording one is a bisect and an increment.
+
+    Percentiles are interpolated within a bucket, which is accurate to within
+    the bucket's width, and never more than the slowest duration seen.
+    """
+
+    __slots__ = ("counts", "count", "sum", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, percent: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = self.count * percent / 100
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                low = BUCKETS[i - 1] if i else 0.0
+                high = BUCKETS[i] if i < len(BUCKETS) else BUCKETS[-1]
+                return min(low + (high - low) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+
+class PipelineMetrics:
+    """
+    Per-stage latency histograms for TTS, overall and for each guild.
+
+    Only the most recently active max_guilds guilds are kept, so the metrics stay
+    small on big bots. The overall histograms count every guild regardless.
+    """
+
+    def __init__(self, max_guilds: int = 1000):
+        self.max_guilds = max_guilds
+        self.started = time.time()
+        self.total: Dict[str, LatencyHistogram] = {
+            stage: LatencyHistogram() for stage in STAGES
+        }
+        self.guilds: "OrderedDict[int, Dict[str, LatencyHistogram]]" = OrderedDict()
+
+    def observe(self, stage: str, guild_id: Optional[int], seconds: float) -> None:
+        self.total[stage].observe(seconds)
+        if guild_id is None:
+            return
+
+        stages = self.guilds.get(guild_id)
+        if stages is None:
+            stages = self.guilds[guild_id] = {}
+            if len(self.guilds) > self.max_guilds:
+                self.guilds.popitem(last=False)
+        else:
+            self.guilds.move_to_end(guild_id)
+        histogram = stages.get(stage)
+        if histogram is None:
+            histogram = stages[stage] = LatencyHistogram()
+        histogram.observe(seconds)
+
+    @contextmanager
+    def time(self, stage: str, guild_id: Optional[int]) -> Iterator[None]:
+        """
+        Records how long the block takes, if it doesn't raise.
+        """
+        start = time.perf_counter()
+        yield
+        self.observe(stage, guild_id, time.perf_counter() - start)
+
+    def histograms(self, guild_id: Optional[int] = None) -> Dict[str, LatencyHistogram]:
+        """
+        Gets the histograms for a guild, or the overall ones.
+        """
+        if guild_id is None:
+            return self.total
+        return self.guilds.get(guild_id, {})
+
+    def summary(
+        self, guild_id: Optional[int] = None
+    ) -> List[Tuple[str, int, Optional[float], Optional[float], Optional[float]]]:
+        """
+        Lists each stage with its count, p50, p95 and p99 in seconds.
+        """
+        histograms = self.histograms(guild_id)
+        rows = []
+        for stage in STAGES:
+            histogram = histograms.get(stage)
+            if not histogram or not histogram.count:
+                rows.append((stage, 0, None, None, None))
+                continue
+            rows.append(
+                (
+                    stage,
+                    histogram.count,
+                    histogram.percentile(50),
+                    histogram.percentile(95),
+                    histogram.percentile(99),
+                )
+            )
+        return rows
+
+    def prometheus(self) -> str:
+        """
+        Renders the metrics in the Prometheus text format.
+
+        The overall latencies are a histogram, and each guild's are a summary of
+        its percentiles, since full buckets for every guild would be huge.
+        """
+        lines = [
+            "# HELP sfx_tts_stage_seconds Time spent in each stage of TTS playback.",
+            "# TYPE sfx_tts_stage_seconds histogram",
+        ]
+        for stage in STAGES:
+            histogram = self.total[stage]
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram.counts):
+                cumulative += count
+                lines.append(
+                    f'sfx_tts_stage_seconds_bucket{{stage="{stage}",le="{bound:.6g}"}} {cumulative}'
+                )
+            lines.append(
+                f'sfx_tts_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}'
+            )
+            lines.append(
+                f'sfx_tts_stage_seconds_sum{{stage="{stage}"}} {histogram.sum:.6f}'
+            )
+            lines.append(
+                f'sfx_tts_stage_seconds_count{{stage="{stage}"}} {histogram.count}'
+            )
+
+        lines += [
+            "# HELP sfx_tts_guild_stage_seconds Time spent in each stage of TTS playback per guild.",
+            "# TYPE sfx_tts_guild_stage_seconds summary",
+        ]
+        for guild_id, stages in self.guilds.items():
+            for stage, histogram in stages.items():
+                labels = f'guild="{guild_id}",stage="{stage}"'
+                for quantile in (0.5, 0.95, 0.99):
+                    value = histogram.percentile(quantile * 100)
+                    lines.append(
+                        f'sfx_tts_guild_stage_seconds{{{labels},quantile="{quantile}"}} {value:.6f}'
+                    )
+                lines.append(
+                    f"sfx_tts_guild_stage_seconds_sum{{{labels}}} {histogram.sum:.6f}"
+                )
+                lines.append(
+                    f"sfx_tts_guild_stage_seconds_count{{{labels}}} {histogram.count}"
+                )
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        self.started = time.time()
+        for stage in STAGES:
+            self.total[stage] = LatencyHistogram()
+        self.guilds.clear()
@@ -27,10 +27,10 @@ class MyTTSCommand(MixinMeta):
         if not voice:
             await ctx.send(f"Your current voice is **{current_voice}**")
             return
-        voice = voice.title()
-        voice = self.get_voice(voice)
+        voice = self.voice_index.get_insensitive(voice)
         if voice:
             await self.config.user(ctx.author).voice.set(voice["name"])
+            self.config_cache.update_user(ctx.author.id, voice=voice["name"])
             await ctx.send(f"Your new TTS voice is: **{voice['name']}**")
         else:
             await ctx.send(
@@ -46,9 +46,11 @@ class MyTTSCommand(MixinMeta):
 
         if current_translate:
             await self.config.user(ctx.author).translate.set(False)
+            self.config_cache.update_user(ctx.author.id, translate=False)
             await ctx.send("Your TTS translation is now off.")
         else:
             await self.config.user(ctx.author).translate.set(True)
+            self.config_cache.update_user(ctx.author.id, translate=True)
             await ctx.send("Your TTS translation is now on.")
 
     @mytts.command()
@@ -63,5 +65,6 @@ class MyTTSCommand(MixinMeta):
             return
 
         await self.config.user(ctx.author).speed.set(speed)
+        self.config_cache.update_user(ctx.author.id, speed=speed)
         await ctx.send(f"Your TTS speed is now {speed}.")
         return
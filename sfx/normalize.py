@@ -0,0 +1,89 @@
+import re
+import unicodedata
+from typing import Match, Optional
+
+import discord
+
+LINK_RE = re.compile(r"https?://\S+", re.IGNORECASE)
+CUSTOM_EMOJI_RE = re.compile(r"<a?:(\w+):\d+>")
+MENTION_RE = re.compile(r"<(@!?|@&|#)(\d+)>")
+# Four or more of the same letter or symbol. Digits are left alone, since numbers
+# like 1000000 have to be read as written.
+REPEATED_CHAR_RE = re.compile(r"([^\s\d])\1{3,}")
+# A short run of letters like "ha" repeated four or more times
+REPEATED_SYLLABLE_RE = re.compile(r"([^\W\d_]{2,4}?)\1{3,}", re.IGNORECASE)
+# The same word four or more times in a row, if it isn't a number
+REPEATED_WORD_RE = re.compile(r"\b([^\W\d_]+)(?:\W+\1\b){3,}", re.IGNORECASE)
+# Pictographs, symbols, skin tones, variation selectors and joiners
+EMOJI_RE = re.compile("[\U0001f000-\U0001faff\u2600-\u27bf\u2b00-\u2bff\ufe0f\u200d]+")
+
+EMOJI_MODES = ("name", "strip")
+MENTION_MODES = ("name", "strip")
+
+
+def canonical(text: str) -> str:
+    """
+    The form of text that's sent to the TTS API and used in cache keys.
+
+    Text that only differs in whitespace or Unicode composition renders the same.
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def _mention_name(guild: Optional[discord.Guild], match: Match) -> str:
+    if not guild:
+        return ""
+    kind, id = match.group(1), int(match.group(2))
+    if kind == "@&":
+        target = guild.get_role(id)
+    elif kind == "#":
+        target = guild.get_channel(id)
+    else:
+        target = guild.get_member(id)
+    if not target:
+        return ""
+    return getattr(target, "display_name", target.name)
+
+
+def _truncate(text: str, max_length: int) -> str:
+    if len(text) <= max_length:
+        return text
+    cut = text.rfind(" ", 0, max_length + 1)
+    return text[: cut if cut > 0 else max_length]
+
+
+def normalize_text(
+    text: str,
+    guild: Optional[discord.Guild] = None,
+    emoji: str = "name",
+    mentions: str = "name",
+    max_length: Optional[int] = None,
+) -> str:
+    """
+    Cleans up text before it's spoken.
+
+    Links are replaced, custom emoji and mentions are read as their names or removed,
+    and runs of repeated characters, syllables and words are shortened. The result is
+    in canonical form and cut to max_length at a word boundary.
+    """
+    text = LINK_RE.sub("link removed", text)
+
+    if emoji == "strip":
+        text = CUSTOM_EMOJI_RE.sub(" ", text)
+        text = EMOJI_RE.sub(" ", text)
+    else:
+        text = CUSTOM_EMOJI_RE.sub(lambda m: f" {m.group(1).replace('_', ' ')} ", text)
+
+    if mentions == "strip":
+        text = MENTION_RE.sub(" ", text)
+    else:
+        text = MENTION_RE.sub(lambda m: f" {_mention_name(guild, m)} ", text)
+
+    text = REPEATED_CHAR_RE.sub(r"\1\1\1", text)
+    text = REPEATED_SYLLABLE_RE.sub(r"\1\1\1", text)
+    text = REPEATED_WORD_RE.sub(lambda m: " ".join([m.group(1)] * 3), text)
+
+    text = canonical(text)
+    if max_length:
+        text = _truncate(text, max_length)
+    return text
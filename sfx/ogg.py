@@ -0,0 +1,139 @@
+import struct
+import zlib
+from typing import Iterator, List, Optional
+
+CAPTURE_PATTERN = b"OggS"
+HEADER = struct.Struct("<4sBBqIIIB")
+
+
+class OggError(Exception):
+    """
+    Raised when data isn't a valid Ogg stream.
+    """
+
+
+class OggPageReader:
+    """
+    Splits Ogg data into complete pages as it arrives.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes) -> List[bytes]:
+        """
+        Adds data and returns every page that's now complete.
+        """
+        self._buffer.extend(data)
+        pages = []
+        while True:
+            size = page_size(self._buffer)
+            if size is None or len(self._buffer) < size:
+                break
+            pages.append(bytes(self._buffer[:size]))
+            del self._buffer[:size]
+        return pages
+
+    @property
+    def pending(self) -> int:
+        return len(self._buffer)
+
+
+def page_size(data: bytes, offset: int = 0) -> Optional[int]:
+    """
+    Gets the size of the page starting at offset, or None if the header is incomplete.
+    """
+    if len(data) - offset < HEADER.size:
+        return None
+    if data[offset : offset + 4] != CAPTURE_PATTERN:
+        raise OggError("Missing Ogg capture pattern")
+    segments = data[offset + 26]
+    if len(data) - offset < HEADER.size + segments:
+        return None
+    lacing = data[offset + HEADER.size : offset + HEADER.size + segments]
+    return HEADER.size + segments + sum(lacing)
+
+
+def iter_pages(data: bytes) -> Iterator[bytes]:
+    """
+    Iterates over the pages of a complete Ogg stream.
+    """
+    offset = 0
+    while offset < len(data):
+        size = page_size(data, offset)
+        if size is None or offset + size > len(data):
+            raise OggError("Truncated Ogg page")
+        yield data[offset : offset + size]
+        offset += size
+
+
+def is_complete(data: bytes) -> bool:
+    """
+    Checks that data is made of whole Ogg pages and ends with the end of a stream.
+    """
+    last = None
+    try:
+        for page in iter_pages(data):
+            last = page
+    except OggError:
+        return False
+    return last is not None and bool(last[5] & 0x04)
+
+
+# Each byte with its bits in reverse order
+REVERSED_BITS = bytes(int(f"{i:08b}"[::-1], 2) for i in range(256))
+
+
+def crc32(data: bytes) -> int:
+    """
+    The CRC used by Ogg, which isn't the same as zlib's.
+
+    It's the same CRC with its bits in the opposite order, so it's worked out with
+    zlib on bit-reversed data instead of byte by byte in Python.
+    """
+    crc = zlib.crc32(bytes(data).translate(REVERSED_BITS), 0xFFFFFFFF) ^ 0xFFFFFFFF
+    return int.from_bytes(crc.to_bytes(4, "little").translate(REVERSED_BITS), "big")
+
+
+def set_serial(page: bytes, serial: int) -> bytes:
+    """
+    Returns a copy of a page with a different stream serial number and a fixed checksum.
+    """
+    page = bytearray(page)
+    struct.pack_into("<I", page, 14, serial)
+    struct.pack_into("<I", page, 22, 0)
+    struct.pack_into("<I", page, 22, crc32(page))
+    return bytes(page)
+
+
+class OggChain:
+    """
+    Joins complete Ogg streams one after another into a single chained stream.
+
+    Players treat a chained stream as one track, so clips play back to back with no
+    gap and nothing is re-encoded. Streams in a chain need distinct serial numbers,
+    so a stream that reuses one gets its pages rewritten.
+    """
+
+    def __init__(self):
+        self._used = set()
+        self._serials = {}
+
+    def pages(self, data: bytes) -> Iterator[bytes]:
+        """
+        Iterates over pages from the next stream(s) in the chain, rewritten as needed.
+
+        Data can be passed in any number of calls, as long as each one is whole pages.
+        """
+        for page in iter_pages(data):
+            _, _, header_type, _, serial, _, _, _ = HEADER.unpack_from(page)
+            if header_type & 0x02:
+                # The first page of a new logical stream
+                new_serial = serial
+                while new_serial in self._used:
+                    new_serial = (new_serial + 1) & 0xFFFFFFFF
+                self._used.add(new_serial)
+                self._serials[serial] = new_serial
+
+            new_serial = self._serials.get(serial, serial)
+            yield page if new_serial == serial else set_serial(page, new_serial)
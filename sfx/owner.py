@@ -0,0 +1,401 @@
+import lavalink
+from redbot.core import commands
+from redbot.core.commands import Context
+from redbot.core.utils.chat_formatting import box, humanize_number, pagify
+
+from .abc import MixinMeta
+from .normalize import normalize_text
+from .ratelimit import RateLimited
+from .store import InvalidSound
+
+
+class OwnerCommandsMixin(MixinMeta):
+    @commands.group()
+    @commands.is_owner()
+    async def sfxset(self, ctx: Context):
+        """
+        Owner settings for the SFX cog.
+        """
+        pass
+
+    @sfxset.group(name="cache", invoke_without_command=True)
+    async def sfxset_cache(self, ctx: Context):
+        """
+        Shows the TTS, Freesound and Lavalink track cache statistics.
+        """
+        stats = self.tts_cache.stats()
+        lookups = stats["hits"] + stats["misses"]
+        hit_rate = f"{stats['hits'] / lookups:.1%}" if lookups else "N/A"
+        await ctx.send(
+            box(
+                f"Entries:  {humanize_number(stats['entries'])}\n"
+                f"Size:     {stats['size'] / 1048576:.1f} / {stats['max_size'] / 1048576:.0f} MB\n"
+                f"Hits:     {humanize_number(stats['hits'])}\n"
+                f"Misses:   {humanize_number(stats['misses'])}\n"
+                f"Hit rate: {hit_rate}\n\n"
+                f"Freesound lookups cached: {humanize_number(self.freesound.hits)}\n"
+                f"Freesound lookups made:   {humanize_number(self.freesound.misses)}\n\n"
+                f"Track loads cached:       {humanize_number(self.track_cache.hits)}\n"
+                f"Track loads made:         {humanize_number(self.track_cache.misses)}"
+            )
+        )
+
+    @sfxset_cache.command(name="size")
+    async def sfxset_cache_size(self, ctx: Context, megabytes: int):
+        """
+        Sets the maximum size of the TTS cache in megabytes.
+        """
+        if megabytes < 1:
+            await ctx.send("The cache size must be at least 1 MB.")
+            return
+
+        await self.config.cache_size.set(megabytes)
+        self.tts_cache.resize(megabytes * 1048576)
+        await ctx.send(f"The TTS cache can now use up to {megabytes} MB.")
+
+    @sfxset_cache.command(name="clear")
+    async def sfxset_cache_clear(self, ctx: Context):
+        """
+        Removes every cached TTS render, Freesound lookup and Lavalink track.
+        """
+        self.tts_cache.clear()
+        self.freesound.clear()
+        self.track_cache.clear()
+        await ctx.send("I've cleared the TTS cache.")
+
+    @sfxset.group(name="relay", invoke_without_command=True)
+    async def sfxset_relay(self, ctx: Context):
+        """
+        Shows the status of the local audio relay.
+
+        The relay serves cached audio to Lavalink over HTTP, so Lavalink doesn't need to fetch it from the internet.
+        """
+        settings = await self.config.all()
+        if self.relay:
+            status = f"Running on {self.relay.host}:{self.relay.port}"
+            if self.relay.advertise:
+                status += f" (advertised as {self.relay.advertise})"
+        elif settings["relay_enabled"]:
+            status = "Enabled, but not running"
+        else:
+            status = "Disabled"
+        await ctx.send(box(f"Status: {status}"))
+
+    @sfxset_relay.command(name="toggle")
+    async def sfxset_relay_toggle(self, ctx: Context):
+        """
+        Toggles the local audio relay.
+        """
+        enabled = not await self.config.relay_enabled()
+        await self.config.relay_enabled.set(enabled)
+        await self.start_relay()
+        if enabled and not self.relay:
+            await ctx.send("The relay is enabled, but I couldn't start it.")
+        elif enabled:
+            await ctx.send("The relay is now enabled.")
+        else:
+            await ctx.send("The relay is now disabled.")
+
+    @sfxset_relay.command(name="bind")
+    async def sfxset_relay_bind(self, ctx: Context, host: str, port: int = 0):
+        """
+        Sets the host and port the relay listens on.
+
+        A port of 0 picks a free port every time the relay starts.
+        """
+        if not 0 <= port <= 65535:
+            await ctx.send("That's not a valid port.")
+            return
+
+        await self.config.relay_host.set(host)
+        await self.config.relay_port.set(port)
+        await self.start_relay()
+        if self.relay:
+            await ctx.send(f"The relay is now listening on {host}:{self.relay.port}.")
+        else:
+            await ctx.send("I've saved that, but the relay isn't running.")
+
+    @sfxset_relay.command(name="advertise")
+    async def sfxset_relay_advertise(self, ctx: Context, host: str = None):
+        """
+        Sets the host Lavalink should use to reach the relay.
+
+        This is only needed if Lavalink runs on a different machine. Leave it empty to use the bind host.
+        """
+        await self.config.relay_advertise.set(host)
+        await self.start_relay()
+        await ctx.send(
+            f"Lavalink will now reach the relay through {host or 'the bind host'}."
+        )
+
+    @sfxset.group(name="library", invoke_without_command=True)
+    async def sfxset_library(self, ctx: Context):
+        """
+        Lists the sounds in the local SFX library.
+
+        The sfx command searches this library before Freesound, so these sounds work without an API key.
+        """
+        if not self.library.sounds:
+            await ctx.send(
+                f"The library is empty. Add sounds with `{ctx.clean_prefix}sfxset library add`."
+            )
+            return
+
+        text = "\n".join(
+            f"{sound['name']}"
+            + (f" ({sound['duration']:.1f}s)" if sound["duration"] else "")
+            + (f" - {', '.join(sound['tags'])}" if sound["tags"] else "")
+            for sound in sorted(self.library.sounds.values(), key=lambda s: s["name"])
+        )
+        for page in pagify(text):
+            await ctx.send(box(page))
+
+    @sfxset_library.command(name="add")
+    async def sfxset_library_add(self, ctx: Context, name: str, *tags: str):
+        """
+        Adds a sound to the local SFX library.
+
+        Attach the sound, or give its URL as the first tag. Use quotes for names with spaces.
+        Tags are extra words the sound can be found by.
+        """
+        if ctx.message.attachments:
+            url = ctx.message.attachments[0].url
+        elif tags and tags[0].startswith(("http://", "https://")):
+            url, tags = tags[0], tags[1:]
+        else:
+            await ctx.send("Please attach a sound or provide its URL.")
+            return
+
+        if not self.library.key(name):
+            await ctx.send("The name needs to have at least one letter or number.")
+            return
+
+        async with ctx.typing():
+            try:
+                data, content_type = await self.sound_store.download(url)
+                path, duration = await self.sound_store.prepare(
+                    data,
+                    content_type,
+                    self.library.path / self.library.key(name).replace(" ", "-")[:64],
+                )
+            except InvalidSound as e:
+                await ctx.send(str(e))
+                return
+
+        self.library.add(name, path, list(tags), duration)
+        await ctx.send(f"I've added **{name}** to the SFX library.")
+
+    @sfxset_library.command(name="remove", aliases=["delete", "del"])
+    async def sfxset_library_remove(self, ctx: Context, *, name: str):
+        """
+        Removes a sound from the local SFX library.
+        """
+        if self.library.remove(name):
+            await ctx.send(f"I've removed **{name}** from the SFX library.")
+        else:
+            await ctx.send("There isn't a sound with that name in the library.")
+
+    @sfxset.command(name="state")
+    async def sfxset_state(self, ctx: Context):
+        """
+        Shows how much playback state the cog is holding, for debugging.
+        """
+        playback = self.playback.counts()
+        scheduler = self.scheduler.stats()
+        await ctx.send(
+            box(
+                f"Guild states:       {humanize_number(playback['guilds'])}\n"
+                f"Playing sounds:     {humanize_number(playback['playing'])}\n"
+                f"Resuming music:     {humanize_number(playback['resuming'])}\n"
+                f"Awaiting end:       {humanize_number(playback['waiting'])}\n"
+                f"Queue workers:      {humanize_number(scheduler['workers'])}\n"
+                f"Queued sounds:      {humanize_number(scheduler['queued'])}\n"
+                f"Skipped join/leave: {humanize_number(self.joinleave_debouncer.skipped)}\n"
+                f"Cached configs:     {humanize_number(len(self.config_cache))}\n"
+                f"TTS renders:        {humanize_number(len(self.tts_renders))}\n"
+                f"TTS streams:        {humanize_number(len(self.tts_streams))}\n"
+                f"TTS API waiting:    {humanize_number(self.tts_limiter.waiting)}\n"
+                f"TTS API rejected:   {humanize_number(self.tts_limiter.rejected)}\n"
+                f"Freesound waiting:  {humanize_number(self.freesound_limiter.waiting)}\n"
+                f"Freesound rejected: {humanize_number(self.freesound_limiter.rejected)}"
+            )
+        )
+
+    @sfxset.group(name="backends", invoke_without_command=True)
+    async def sfxset_backends(self, ctx: Context):
+        """
+        Shows the TTS backends and how they've been doing.
+
+        TTS is rendered by the healthiest, fastest backend. If it's slow to start, the next one is tried at the same time. Fallbacks don't sound like the chosen voice, so they're only used when no other backend can render.
+        """
+        lines = []
+        for backend in self.tts_router.backends:
+            stats = self.tts_router.stats[backend.name]
+            if not stats.enabled:
+                status = "Disabled"
+            elif not backend.available:
+                status = "Unavailable"
+            elif not stats.health.available:
+                status = f"Backing off for {stats.health.retry_in:.0f}s"
+            elif not stats.health.healthy:
+                status = "Recovering"
+            else:
+                status = "Healthy"
+            latency = (
+                f"{stats.latency * 1000:.0f} ms" if stats.latency is not None else "N/A"
+            )
+            name = f"{backend.name} (fallback)" if backend.fallback else backend.name
+            lines.append(f"{name:<18} {status:<24} {latency}")
+        await ctx.send(box("\n".join(lines)))
+
+    @sfxset_backends.command(name="toggle")
+    async def sfxset_backends_toggle(self, ctx: Context, name: str):
+        """
+        Turns a TTS backend on or off.
+
+        The local backend needs eSpeak NG and FFmpeg to be installed.
+        """
+        backend = self.tts_router.get(name.lower())
+        if not backend:
+            names = ", ".join(b.name for b in self.tts_router.backends)
+            await ctx.send(f"That's not a backend. The backends are: {names}.")
+            return
+
+        stats = self.tts_router.stats[backend.name]
+        stats.enabled = not stats.enabled
+        async with self.config.disabled_backends() as disabled:
+            if stats.enabled and backend.name in disabled:
+                disabled.remove(backend.name)
+            elif not stats.enabled and backend.name not in disabled:
+                disabled.append(backend.name)
+
+        if not stats.enabled:
+            await ctx.send(f"The {backend.name} backend is now disabled.")
+        elif not backend.available:
+            await ctx.send(
+                f"The {backend.name} backend is now enabled, but it can't run here."
+            )
+        else:
+            await ctx.send(f"The {backend.name} backend is now enabled.")
+
+    @sfxset.group(name="latency", invoke_without_command=True)
+    async def sfxset_latency(self, ctx: Context, guild_id: int = None):
+        """
+        Shows how long each stage of TTS takes, overall or for one server.
+
+        The stages are checking permissions, reading settings, waiting in the queue, rendering, loading the track in Lavalink and Lavalink starting it.
+        """
+        rows = self.metrics.summary(guild_id)
+        if not any(count for _, count, *_ in rows):
+            await ctx.send("There's no TTS timings for that yet.")
+            return
+
+        def ms(seconds):
+            return f"{seconds * 1000:.0f} ms" if seconds is not None else "N/A"
+
+        lines = [f"{'Stage':<12} {'Count':>8} {'p50':>9} {'p95':>9} {'p99':>9}"]
+        for stage, count, p50, p95, p99 in rows:
+            lines.append(
+                f"{stage:<12} {humanize_number(count):>8} {ms(p50):>9} {ms(p95):>9} {ms(p99):>9}"
+            )
+        since = f"<t:{int(self.metrics.started)}:R>"
+        title = f"Server {guild_id}" if guild_id else "All servers"
+        await ctx.send(f"{title}, since {since}:" + box("\n".join(lines)))
+
+    @sfxset_latency.command(name="reset")
+    async def sfxset_latency_reset(self, ctx: Context):
+        """
+        Clears the TTS timings.
+        """
+        self.metrics.reset()
+        await ctx.send("I've cleared the TTS timings.")
+
+    @sfxset_latency.command(name="export")
+    async def sfxset_latency_export(self, ctx: Context, *, path: str = None):
+        """
+        Sets a file to write the TTS timings to every minute, in the Prometheus text format.
+
+        This works with Prometheus's textfile collector. Leave the path empty to stop exporting.
+        """
+        await self.config.metrics_path.set(path)
+        if not path:
+            await ctx.send("I'll no longer export the TTS timings.")
+            return
+
+        if not await self.write_metrics(path):
+            await ctx.send(
+                f"I've saved that, but I couldn't write to `{path}`. Check the logs for details."
+            )
+            return
+        await ctx.send(f"I'll now write the TTS timings to `{path}` every minute.")
+
+    @sfxset.command(name="broadcast")
+    async def sfxset_broadcast(self, ctx: Context, *, text: str):
+        """
+        Says something in every voice channel the bot is connected to, in your TTS voice.
+
+        To only announce in some servers, put their IDs before the text. Only IDs of servers the bot is in count, so text starting with a number is left alone. The text is only rendered once, however many servers hear it.
+        """
+        guild_ids = set()
+        words = text.split(maxsplit=1)
+        while words and words[0].isdigit() and self.bot.get_guild(int(words[0])):
+            guild_ids.add(int(words[0]))
+            text = words[1] if len(words) > 1 else ""
+            words = text.split(maxsplit=1)
+        if not text:
+            await ctx.send_help()
+            return
+
+        players = [player for player in lavalink.all_players() if player.channel]
+        if guild_ids:
+            players = [player for player in players if player.guild.id in guild_ids]
+        if not players:
+            await ctx.send(
+                "I'm not connected to a voice channel in any of those servers."
+            )
+            return
+
+        text = normalize_text(text)
+        if not text:
+            await ctx.send("There's nothing left to say once that's cleaned up.")
+            return
+
+        user_config = await self.config_cache.user(ctx.author)
+        try:
+            async with ctx.typing():
+                path = await self.render_tts_file(
+                    user_config["voice"],
+                    user_config["translate"],
+                    text,
+                    user_config["speed"],
+                )
+        except RateLimited:
+            await ctx.send(
+                "The TTS API is too busy to render that right now, please try again in a bit."
+            )
+            return
+        if not path:
+            await ctx.send(
+                "Something went wrong when rendering that, please try again later."
+            )
+            return
+
+        await ctx.send(f"Broadcasting to {humanize_number(len(players))} servers...")
+        results = await self.broadcast(path, players, ("Announcement", ctx.author))
+
+        counts = {}
+        for status in results.values():
+            counts[status] = counts.get(status, 0) + 1
+        summary = ", ".join(
+            f"{status}: {humanize_number(count)}"
+            for status, count in sorted(counts.items())
+        )
+        failed = "\n".join(
+            f"{self.bot.get_guild(guild_id) or guild_id} ({guild_id}): {status}"
+            for guild_id, status in results.items()
+            if status != "Played"
+        )
+        await ctx.send(f"Done. {summary}")
+        if failed:
+            for page in pagify(failed):
+                await ctx.send(box(page))
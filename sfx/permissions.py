@@ -0,0 +1,67 @@
+import time
+from typing import Dict, Hashable, Optional, Tuple
+
+
+class PermissionCache:
+    """
+    Remembers whether a member can use a command in a channel.
+
+    Entries are keyed by the guild, channel, member and the member's roles, and are
+    invalidated by the events that could change the outcome. The TTL is a safety
+    net for changes there's no event for.
+    """
+
+    def __init__(self, ttl: float = 300):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._guilds: Dict[int, Dict[Hashable, Tuple[bool, float]]] = {}
+
+    def get(self, guild_id: int, key: Hashable) -> Optional[bool]:
+        """
+        Gets a cached decision, or None if there isn't a fresh one.
+        """
+        entry = self._guilds.get(guild_id, {}).get(key)
+        if entry is None or entry[1] < time.monotonic():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    def set(self, guild_id: int, key: Hashable, value: bool) -> None:
+        self._guilds.setdefault(guild_id, {})[key] = (
+            value,
+            time.monotonic() + self.ttl,
+        )
+
+    def invalidate_guild(self, guild_id: int) -> None:
+        self._guilds.pop(guild_id, None)
+
+    def invalidate_member(self, guild_id: int, member_id: int) -> None:
+        entries = self._guilds.get(guild_id)
+        if not entries:
+            return
+        # Keys are (channel ID, member ID, role IDs)
+        for key in [k for k in entries if k[1] == member_id]:
+            del entries[key]
+
+    def invalidate_channel(self, guild_id: int, channel_id: int) -> None:
+        entries = self._guilds.get(guild_id)
+        if not entries:
+            return
+        for key in [k for k in entries if k[0] == channel_id]:
+            del entries[key]
+
+    def clear(self) -> None:
+        self._guilds.clear()
+
+    def prune(self) -> None:
+        """
+        Removes expired entries.
+        """
+        now = time.monotonic()
+        for guild_id, entries in list(self._guilds.items()):
+            for key in [k for k, (_, expires) in entries.items() if expires < now]:
+                del entries[key]
+            if not entries:
+                del self._guilds[guild_id]
@@ -0,0 +1,198 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Optional
+
+
+class RateLimited(Exception):
+    """
+    Raised when a request couldn't go out before its deadline.
+    """
+
+
+class TokenBucket:
+    """
+    Allows rate requests a second on average, and bursts of up to capacity.
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """
+        How long until a token is available, in seconds.
+        """
+        self.refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    @property
+    def full(self) -> bool:
+        self.refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class RateLimiter:
+    """
+    Paces outbound requests to a service, with a global and a per-guild token bucket.
+
+    Requests that can't go out right away wait in a queue instead of failing, up to a
+    deadline. Guilds with waiting requests take turns, so one busy guild can't starve
+    the others. When the service says to back off, nothing goes out until it's time.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+        guild_rate: float,
+        guild_burst: float,
+        max_wait: float = 10,
+    ):
+        self.guild_rate = guild_rate
+        self.guild_burst = guild_burst
+        self.max_wait = max_wait
+        self.rejected = 0
+        self._bucket = TokenBucket(rate, burst)
+        self._guild_buckets: Dict[int, TokenBucket] = {}
+        self._paused_until = 0.0
+        # Guild ID -> waiting requests, in the order guilds get their turn
+        self._waiting: "OrderedDict[Optional[int], Deque[asyncio.Future]]" = (
+            OrderedDict()
+        )
+        self._wakeup = asyncio.Event()
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    def _guild_bucket(self, guild_id: Optional[int]) -> Optional[TokenBucket]:
+        if guild_id is None:
+            return None
+        bucket = self._guild_buckets.get(guild_id)
+        if bucket is None:
+            bucket = self._guild_buckets[guild_id] = TokenBucket(
+                self.guild_rate, self.guild_burst
+            )
+        return bucket
+
+    def _wait_time(self, guild_id: Optional[int], now: float) -> float:
+        bucket = self._guild_bucket(guild_id)
+        return max(
+            self._paused_until - now,
+            self._bucket.wait_time(now),
+            bucket.wait_time(now) if bucket else 0.0,
+        )
+
+    def _take(self, guild_id: Optional[int]) -> None:
+        self._bucket.tokens -= 1
+        bucket = self._guild_bucket(guild_id)
+        if bucket:
+            bucket.tokens -= 1
+
+    async def acquire(
+        self, guild_id: Optional[int] = None, timeout: Optional[float] = None
+    ) -> None:
+        """
+        Waits until a request for the guild can go out.
+
+        Raises RateLimited if that would take longer than timeout, or max_wait by default.
+        """
+        if not self._waiting and not self._wait_time(guild_id, time.monotonic()):
+            self._take(guild_id)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(guild_id, deque()).append(future)
+        self._wakeup.set()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+        try:
+            await asyncio.wait_for(
+                future, timeout=self.max_wait if timeout is None else timeout
+            )
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise RateLimited("Too many requests are waiting") from None
+
+    async def _dispatch(self) -> None:
+        while self._waiting:
+            self._wakeup.clear()
+            now = time.monotonic()
+            soonest = None
+            for guild_id in list(self._waiting):
+                queue = self._waiting[guild_id]
+                while queue and queue[0].done():
+                    queue.popleft()
+                if not queue:
+                    del self._waiting[guild_id]
+                    continue
+
+                wait = self._wait_time(guild_id, now)
+                if wait:
+                    soonest = wait if soonest is None else min(soonest, wait)
+                    continue
+
+                self._take(guild_id)
+                queue.popleft().set_result(None)
+                # Send the guild to the back of the line
+                self._waiting.move_to_end(guild_id)
+                if not queue:
+                    del self._waiting[guild_id]
+                soonest = 0
+                break
+
+            if soonest is None:
+                continue
+            if soonest:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=soonest)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(0)
+
+    def pause(self, seconds: float) -> None:
+        """
+        Holds every request for a while, such as when the service sent Retry-After.
+        """
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    @property
+    def waiting(self) -> int:
+        return sum(
+            not future.done() for queue in self._waiting.values() for future in queue
+        )
+
+    def prune(self) -> None:
+        """
+        Drops guild buckets that have filled back up, since they're the same as new ones.
+        """
+        for guild_id, bucket in list(self._guild_buckets.items()):
+            if bucket.full and guild_id not in self._waiting:
+                del self._guild_buckets[guild_id]
+
+    def cancel(self) -> None:
+        """
+        Stops handing out turns. Used when the cog is unloaded.
+        """
+        if self._dispatcher:
+            self._dispatcher.cancel()
+
+
+def retry_after(headers, default: float = 5) -> float:
+    """
+    Gets how long a response asked us to wait, in seconds.
+    """
+    try:
+        return max(float(headers.get("Retry-After", default)), 0.0)
+    except ValueError:
+        return default
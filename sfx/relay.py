@@ -0,0 +1,297 @@
+import asyncio
+import hashlib
+import logging
+import mimetypes
+import secrets
+from collections import OrderedDict
+from pathlib import Path
+from typing import AsyncIterator, Optional, Tuple
+
+from aiohttp import web
+
+from .ogg import OggError, OggPageReader
+
+log = logging.getLogger("red.kao.sfx")
+
+CONTENT_TYPES = {
+    ".ogg": "audio/ogg",
+    ".opus": "audio/ogg",
+    ".mp3": "audio/mpeg",
+    ".wav": "audio/wav",
+}
+
+
+class AudioStream:
+    """
+    Audio that's still being received from upstream.
+
+    Any number of clients can read it while it arrives. Ogg data is only exposed
+    a whole page at a time.
+    """
+
+    def __init__(
+        self,
+        chunks: AsyncIterator[bytes],
+        content_type: str,
+    ):
+        self.content_type = content_type
+        self.buffer = bytearray()
+        self.done = False
+        self.failed = False
+        self.error: Optional[Exception] = None
+        self._condition = asyncio.Condition()
+        self._task = asyncio.create_task(self._receive(chunks))
+
+    async def _append(self, data: bytes) -> None:
+        async with self._condition:
+            self.buffer.extend(data)
+            self._condition.notify_all()
+
+    async def _receive(self, chunks: AsyncIterator[bytes]) -> None:
+        reader = OggPageReader() if self.content_type == "audio/ogg" else None
+        try:
+            async for chunk in chunks:
+                if reader:
+                    for page in reader.feed(chunk):
+                        await self._append(page)
+                else:
+                    await self._append(chunk)
+            if reader and reader.pending:
+                raise OggError("Upstream ended in the middle of a page")
+        except asyncio.CancelledError:
+            self.failed = True
+            raise
+        except Exception as e:
+            self.failed = True
+            self.error = e
+            log.debug("Audio stream failed", exc_info=True)
+        finally:
+            async with self._condition:
+                self.done = True
+                self._condition.notify_all()
+
+    async def wait_for(self, position: int) -> None:
+        """
+        Waits until there's data past position, or the stream has ended.
+        """
+        async with self._condition:
+            await self._condition.wait_for(
+                lambda: len(self.buffer) > position or self.done
+            )
+
+    async def wait_done(self) -> None:
+        """
+        Waits until the stream has ended.
+        """
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.done)
+
+    def cancel(self) -> None:
+        self._task.cancel()
+
+
+class AudioRelay:
+    """
+    A small HTTP server that lets Lavalink play audio the bot already has.
+
+    Clips are only reachable by the opaque ids handed out by `add_file` and
+    `add_stream`, so nothing else on disk is ever exposed. Only the most recently
+    used MAX_FILES files are kept reachable.
+    """
+
+    MAX_STREAMS = 32
+    MAX_FILES = 1024
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        advertise: Optional[str] = None,
+    ):
+        self.host = host
+        self.port = port
+        self.advertise = advertise
+        self._files: "OrderedDict[str, Tuple[Path, str]]" = OrderedDict()
+        self._streams: "OrderedDict[str, AudioStream]" = OrderedDict()
+        self._runner: Optional[web.AppRunner] = None
+
+        self.app = web.Application()
+        self.app.router.add_get("/clips/{clip_id}", self.handle_clip)
+
+    async def start(self) -> None:
+        """
+        Starts listening. If the port is 0, a free port is picked.
+        """
+        runner = web.AppRunner(self.app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, self.host, self.port)
+        try:
+            await site.start()
+        except OSError:
+            await runner.cleanup()
+            raise
+        self.port = runner.addresses[0][1]
+        self._runner = runner
+
+    async def close(self) -> None:
+        for stream in self._streams.values():
+            stream.cancel()
+        self._streams.clear()
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    @staticmethod
+    def content_type(name: str) -> str:
+        suffix = Path(name).suffix.lower()
+        return (
+            CONTENT_TYPES.get(suffix)
+            or mimetypes.guess_type(name)[0]
+            or "application/octet-stream"
+        )
+
+    def url(self, clip_id: str) -> str:
+        """
+        Gets the URL Lavalink should use to fetch a clip.
+        """
+        return f"http://{self.advertise or self.host}:{self.port}/clips/{clip_id}"
+
+    def add_file(self, path: Path, content_type: Optional[str] = None) -> str:
+        """
+        Makes a file on disk available and returns its clip id.
+
+        The id is derived from the path, so the same file always has the same URL.
+        """
+        clip_id = hashlib.sha256(str(path).encode()).hexdigest()[:32] + path.suffix
+        self._files[clip_id] = (path, content_type or self.content_type(path.name))
+        self._files.move_to_end(clip_id)
+        while len(self._files) > self.MAX_FILES:
+            self._files.popitem(last=False)
+        return clip_id
+
+    async def wait_started(self, clip_id: str) -> Optional[Exception]:
+        """
+        Waits until a streaming clip has data, and returns the error it failed with if it ended without any.
+        """
+        stream = self._streams.get(clip_id)
+        if not stream:
+            return None
+        await stream.wait_for(0)
+        return None if stream.buffer else stream.error
+
+    def is_stream(self, url: str) -> bool:
+        """
+        Whether a URL is for a streaming clip. Those are only ever played once.
+        """
+        return url.rpartition("/")[2] in self._streams
+
+    def add_stream(
+        self,
+        chunks: AsyncIterator[bytes],
+        content_type: str,
+        suffix: str = "",
+    ) -> str:
+        """
+        Starts relaying audio from an async iterator of chunks and returns its clip id.
+
+        Clients can start reading before it has finished arriving. Only the newest
+        MAX_STREAMS streams are kept, and older ones are stopped if they're somehow
+        still arriving, so a stuck upstream can't hold on to them.
+        """
+        clip_id = secrets.token_urlsafe(16) + suffix
+        self._streams[clip_id] = AudioStream(chunks, content_type)
+        while len(self._streams) > self.MAX_STREAMS:
+            _, oldest = self._streams.popitem(last=False)
+            oldest.cancel()
+        return clip_id
+
+    async def handle_clip(self, request: web.Request) -> web.StreamResponse:
+        clip_id = request.match_info["clip_id"]
+
+        if clip_id in self._files:
+            path, content_type = self._files[clip_id]
+            if not path.is_file():
+                del self._files[clip_id]
+                raise web.HTTPNotFound()
+            # FileResponse handles HEAD and Range requests itself
+            return web.FileResponse(path, headers={"Content-Type": content_type})
+
+        if clip_id in self._streams:
+            stream = self._streams[clip_id]
+            if self._partial(request) and not stream.done:
+                # A range can only be described once the total length is known
+                await stream.wait_done()
+            if stream.done and not stream.failed:
+                return self._bytes_response(
+                    request, bytes(stream.buffer), stream.content_type
+                )
+            return await self._stream_response(request, stream)
+
+        raise web.HTTPNotFound()
+
+    @staticmethod
+    def _partial(request: web.Request) -> bool:
+        """
+        Whether a request asks for less than the whole clip.
+        """
+        if request.headers.get("Range") is None:
+            return False
+        try:
+            http_range = request.http_range
+        except ValueError:
+            return True
+        return bool(http_range.start) or http_range.stop is not None
+
+    @staticmethod
+    async def _stream_response(
+        request: web.Request, stream: AudioStream
+    ) -> web.StreamResponse:
+        """
+        Sends a stream from the start while it arrives, without a length.
+        """
+        await stream.wait_for(0)
+        if not stream.buffer:
+            raise web.HTTPBadGateway()
+
+        response = web.StreamResponse(headers={"Content-Type": stream.content_type})
+        await response.prepare(request)
+        if request.method == "HEAD":
+            return response
+
+        position = 0
+        while True:
+            if position < len(stream.buffer):
+                chunk = bytes(stream.buffer[position : position + 65536])
+                await response.write(chunk)
+                position += len(chunk)
+            elif stream.done:
+                break
+            else:
+                await stream.wait_for(position)
+
+        await response.write_eof()
+        return response
+
+    @staticmethod
+    def _bytes_response(
+        request: web.Request, data: bytes, content_type: str
+    ) -> web.Response:
+        headers = {"Accept-Ranges": "bytes", "Content-Type": content_type}
+        try:
+            http_range = request.http_range
+        except ValueError:
+            raise web.HTTPRequestRangeNotSatisfiable(
+                headers={"Content-Range": f"bytes */{len(data)}"}
+            )
+
+        start, stop, _ = http_range.indices(len(data))
+        if request.headers.get("Range") is None or (start, stop) == (0, len(data)):
+            return web.Response(body=data, headers=headers)
+
+        if start >= stop:
+            raise web.HTTPRequestRangeNotSatisfiable(
+                headers={"Content-Range": f"bytes */{len(data)}"}
+            )
+
+        headers["Content-Range"] = f"bytes {start}-{stop - 1}/{len(data)}"
+        return web.Response(status=206, body=data[start:stop], headers=headers)
@@ -0,0 +1,188 @@
+import asyncio
+import itertools
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Union
+
+log = logging.getLogger("red.kao.sfx")
+
+# Lower numbers play first
+PRIORITIES = {
+    "tts": 0,
+    "autotts": 0,
+    "ttschannel": 0,
+    "broadcast": 0,
+    "sfx": 1,
+    "joinleave": 2,
+}
+
+Source = Union[str, Callable[[], Awaitable[Optional[str]]]]
+
+
+class PlaybackRequest:
+    """
+    A sound waiting to be played in a guild.
+
+    The source is either a URL, or a coroutine function that returns one. Coroutine
+    functions aren't called until the request is about to play, so requests that are
+    dropped never cost a render.
+
+    The future resolves to True once the sound has been played, or False if it was
+    dropped, merged into another request or failed to play.
+    """
+
+    _counter = itertools.count()
+
+    def __init__(
+        self,
+        guild_id: int,
+        type: str,
+        source: Source,
+        play: Callable[["PlaybackRequest", str], Awaitable[Optional[Awaitable]]],
+        merge_key: Optional[Hashable] = None,
+    ):
+        self.guild_id = guild_id
+        self.type = type
+        self.priority = PRIORITIES.get(type, 1)
+        self.source = source
+        self.play = play
+        self.merge_key = merge_key
+        self.order = next(self._counter)
+        # The track length in milliseconds, once it's known
+        self.length = 0
+        # When the request was queued, and when a worker picked it up
+        self.queued_at = time.monotonic()
+        self.dequeued_at: Optional[float] = None
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._resolving: Optional[asyncio.Task] = None
+
+    def prefetch(self) -> None:
+        """
+        Starts resolving the source in the background.
+        """
+        if self._resolving is None and not isinstance(self.source, str):
+            self._resolving = asyncio.create_task(self.source())
+
+    async def resolve(self) -> Optional[str]:
+        if isinstance(self.source, str):
+            return self.source
+        self.prefetch()
+        return await self._resolving
+
+    def finish(self, played: bool) -> None:
+        if not self.future.done():
+            self.future.set_result(played)
+        if self._resolving and not self._resolving.done():
+            self._resolving.cancel()
+
+
+class PlaybackScheduler:
+    """
+    Plays sounds one at a time per guild, in priority order.
+
+    Each guild has a bounded queue and a worker that talks to Lavalink, so concurrent
+    sounds can't race each other. When a queue is full, the lowest priority request is
+    dropped, which is the new one if nothing queued is lower priority.
+    """
+
+    def __init__(
+        self, max_queue: int = 10, max_wait: float = 60, max_length: float = 600
+    ):
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.max_length = max_length
+        self._queues: Dict[int, List[PlaybackRequest]] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+
+    def submit(self, request: PlaybackRequest) -> bool:
+        """
+        Queues a request. Returns False if it was dropped or merged instead.
+        """
+        queue = self._queues.setdefault(request.guild_id, [])
+
+        if request.merge_key is not None:
+            for queued in queue:
+                if queued.merge_key == request.merge_key:
+                    request.finish(False)
+                    return False
+
+        if len(queue) >= self.max_queue:
+            worst = max(queue, key=lambda r: (r.priority, r.order))
+            if worst.priority <= request.priority:
+                request.finish(False)
+                return False
+            queue.remove(worst)
+            worst.finish(False)
+
+        queue.append(request)
+        if request.guild_id not in self._workers:
+            self._workers[request.guild_id] = asyncio.create_task(
+                self._worker(request.guild_id)
+            )
+        return True
+
+    def _next(self, queue: List[PlaybackRequest]) -> PlaybackRequest:
+        request = min(queue, key=lambda r: (r.priority, r.order))
+        queue.remove(request)
+        request.dequeued_at = time.monotonic()
+        return request
+
+    async def _worker(self, guild_id: int) -> None:
+        queue = self._queues[guild_id]
+        try:
+            while queue:
+                request = self._next(queue)
+                finished = None
+                try:
+                    url = await request.resolve()
+                    if url:
+                        finished = await request.play(request, url)
+                except asyncio.CancelledError:
+                    request.finish(False)
+                    raise
+                except Exception:
+                    log.exception("Error playing a sound in guild %s", guild_id)
+
+                request.finish(finished is not None)
+                if finished is None:
+                    continue
+
+                # Get the next sound ready while this one plays
+                if queue:
+                    min(queue, key=lambda r: (r.priority, r.order)).prefetch()
+
+                try:
+                    await asyncio.wait_for(
+                        asyncio.shield(finished), timeout=self.timeout_for(request)
+                    )
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for request in queue:
+                request.finish(False)
+            self._queues.pop(guild_id, None)
+            self._workers.pop(guild_id, None)
+
+    def timeout_for(self, request: PlaybackRequest) -> float:
+        """
+        How long to wait for a sound to finish before moving on regardless.
+
+        Sounds whose length is unknown or longer than max_length seconds get max_wait,
+        since streams report a huge placeholder length.
+        """
+        if request.length and request.length / 1000 <= self.max_length:
+            return request.length / 1000 + 5
+        return self.max_wait
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "workers": len(self._workers),
+            "queued": sum(len(queue) for queue in self._queues.values()),
+        }
+
+    def cancel(self) -> None:
+        """
+        Stops every worker. Used when the cog is unloaded.
+        """
+        for worker in self._workers.values():
+            worker.cancel()
@@ -1,6 +1,11 @@
-import re
-from typing import Optional
-from urllib.parse import quote
+import asyncio
+import copy
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import AsyncIterator, Dict, Hashable, List, Optional, Set, Tuple
 
 import aiohttp
 import discord
@@ -10,6 +15,7 @@ from lavalink import PlayerNotFound
 from redbot.core import Config, commands
 from redbot.core.bot import Red
 from redbot.core.commands import Context
+from redbot.core.data_manager import cog_data_path
 
 try:
     from lavalink import NodeNotFound as NoLavalinkNode
@@ -18,10 +24,44 @@ except ImportError:
 
 from .abc import CompositeMetaClass
 from .autotts import AutoTTSMixin
+from .backends import (
+    FloweryBackend,
+    LocalBackend,
+    RenderInfo,
+    TTSError,
+    TTSRouter,
+)
+from .cache import TTSCache
+from .catalog import VoiceCatalog
 from .channels import TTSChannelMixin
+from .chunking import split_text
+from .coalescer import MessageCoalescer
 from .commands import BaseCommandsMixin
+from .configcache import ConfigCache
+from .debounce import EventDebouncer
+from .freesound import FreesoundClient
+from .health import HealthTracker
 from .joinandleave import JoinAndLeaveMixin
+from .library import SoundLibrary
+from .metrics import PipelineMetrics
 from .mytts import MyTTSCommand
+from .normalize import normalize_text
+from .ogg import OggChain, OggError, OggPageReader, is_complete
+from .owner import OwnerCommandsMixin
+from .permissions import PermissionCache
+from .ratelimit import RateLimited, RateLimiter
+from .relay import AudioRelay
+from .scheduler import PRIORITIES, PlaybackRequest, PlaybackScheduler, Source
+from .state import PlaybackState, PlaybackStates
+from .store import SoundStore
+from .tracks import TrackCache
+from .ttsset import TTSSettingsMixin
+from .voices import VoiceIndex
+
+log = logging.getLogger("red.kao.sfx")
+
+# The close code red-lavalink uses for its own reconnects
+LAVALINK_RECONNECTED = 42069
 
 
 class SFX(
@@ -31,6 +71,8 @@ class SFX(
     commands.Cog,
     JoinAndLeaveMixin,
     MyTTSCommand,
+    OwnerCommandsMixin,
+    TTSSettingsMixin,
     metaclass=CompositeMetaClass,
 ):
     """
@@ -41,6 +83,21 @@ class SFX(
 
     TTS_API_URL = "https://api.flowery.pw/v1/tts"
     SFX_API_URL = "https://freesound.org/apiv2"
+    # How many parts of a long message are rendered at once
+    RENDER_WORKERS = 3
+    # How many guilds a broadcast is handed to at once
+    BROADCAST_WORKERS = 10
+    # How long to wait for a broadcast to start playing in a guild
+    BROADCAST_TIMEOUT = 120
+    # Red commands that can change whether someone is allowed to run a command
+    PERMISSION_COMMANDS = {
+        "permissions",
+        "command",
+        "allowlist",
+        "blocklist",
+        "localallowlist",
+        "localblocklist",
+    }
 
     def __init__(self, bot: Red):
         self.bot = bot
@@ -66,26 +123,95 @@ class SFX(
             "priority": "guild",
             "disabled_users": [],
             "say_name": False,
+            "autotts_users": [],
+            "coalesce_window": 1.0,
+            "coalesce_max_length": 400,
+            "emoji_mode": "name",
+            "mention_mode": "name",
+            "max_tts_length": None,
+        }
+        global_config = {
+            "cache_size": 256,
+            "relay_enabled": True,
+            "relay_host": "127.0.0.1",
+            "relay_port": 0,
+            "relay_advertise": None,
+            "disabled_backends": [],
+            "metrics_path": None,
         }
         self.config.register_user(**user_config)
         self.config.register_guild(**guild_config)
+        self.config.register_global(**global_config)
+        self.config_cache = ConfigCache(self.config)
+        self.permission_cache = PermissionCache()
+        # Freesound allows 60 requests a minute per key, so a full burst of 10 plus
+        # 50 more over the rest of the minute stays within it
+        self.freesound_limiter = RateLimiter(50 / 60, 10, 0.2, 3)
+        self.tts_limiter = RateLimiter(10, 20, 2, 6)
+        self.freesound = FreesoundClient(
+            self.session, self.SFX_API_URL, limiter=self.freesound_limiter
+        )
+        self.flowery = FloweryBackend(
+            self.session, self.TTS_API_URL, limiter=self.tts_limiter
+        )
+        self.tts_router = TTSRouter([self.flowery, LocalBackend(self.get_voice)])
+        self.tts_cache = TTSCache(
+            cog_data_path(self) / "tts_cache", global_config["cache_size"] * 1048576
+        )
+        self.tts_renders: Dict[str, asyncio.Task] = {}
+        self.tts_streams: Dict[str, str] = {}
+        self.relay: Optional[AudioRelay] = None
+        # Whether the owner has been told Lavalink can't load audio from the bot
+        self.warned_unreachable = False
+        self.sound_store = SoundStore(
+            cog_data_path(self) / "sounds", dict(self.session.headers)
+        )
+        self.failed_sound_urls = set()
+        self.library = SoundLibrary(cog_data_path(self) / "library")
         lavalink.register_event_listener(self.ll_check)
         self.bot.loop.create_task(self.set_token())
-        self.bot.loop.create_task(self.maybe_get_voices())
-        self.bot.loop.create_task(self.get_voices())
-        self.last_track_info = {}
-        self.current_sfx = {}
-        self.repeat_state = {}
+        self.bot.loop.create_task(self.load_cache_size())
+        self.bot.loop.create_task(self.load_disabled_backends())
+        self.bot.loop.create_task(self.start_relay())
+        self.evict_idle_caches.start()
+        self.metrics = PipelineMetrics()
+        self.export_metrics.start()
+        self.playback = PlaybackStates()
+        self.track_cache = TrackCache()
+        self.scheduler = PlaybackScheduler()
+        self.coalescer = MessageCoalescer()
+        self.joinleave_debouncer = EventDebouncer()
         self.voices = []
-        self.autotts = []
+        self.voice_index = VoiceIndex([])
+        self.voice_catalog = VoiceCatalog(self.voice_index)
+        self.voices_health = HealthTracker()
+        self.voices_etag: Optional[str] = None
+        self.voices_last_modified: Optional[str] = None
+        self.load_voices()
+        self.voices_task = self.bot.loop.create_task(self.refresh_voices_loop())
+        # Guild ID -> user IDs with AutoTTS enabled, and guild ID -> TTS channel IDs.
+        # These let the message listeners reject messages without awaiting anything.
+        self.autotts: Dict[int, Set[int]] = {}
+        self.tts_channels: Dict[int, Set[int]] = {}
+        self.bot.loop.create_task(self.load_indexes())
 
     def cog_unload(self) -> None:
         """
         Runs when the cog is unloaded.
 
-        Closes the Aiohttp session, sets back all the player repeat states, and removes the event listener for lavalink.
+        Closes the Aiohttp session and the audio relay, sets back all the player repeat states, and removes the event listener for lavalink.
         """
         self.bot.loop.create_task(self.session.close())
+        self.bot.loop.create_task(self.sound_store.close())
+        self.bot.loop.create_task(self.stop_relay())
+        self.evict_idle_caches.cancel()
+        self.export_metrics.cancel()
+        self.tts_limiter.cancel()
+        self.freesound_limiter.cancel()
+        self.scheduler.cancel()
+        self.voices_task.cancel()
+        self.coalescer.cancel()
+        self.joinleave_debouncer.cancel()
         self.bot.loop.create_task(self.reset_player_states())
         lavalink.unregister_event_listener(self.ll_check)
 
@@ -94,6 +220,12 @@ class SFX(
         Clears a user's data when it's requested.
         """
         await self.config.user_from_id(kwargs["user_id"]).clear()
+        self.config_cache.invalidate_user(kwargs["user_id"])
+        self.sound_store.delete("user", kwargs["user_id"], "join")
+        self.sound_store.delete("user", kwargs["user_id"], "leave")
+        for guild_id, users in list(self.autotts.items()):
+            if kwargs["user_id"] in users:
+                await self.set_autotts(guild_id, kwargs["user_id"], False)
 
     def format_help_for_context(self, ctx: Context) -> str:
         """
@@ -102,28 +234,135 @@ class SFX(
         pre_processed = super().format_help_for_context(ctx)
         return f"{pre_processed}\n\nCog Version: {self.__version__}"
 
-    @tasks.loop(hours=12)
-    async def get_voices(self) -> None:
+    def load_voices(self) -> None:
+        """
+        Loads the voices saved by the last refresh, so voices can be validated as soon as the cog loads.
         """
-        Stores all the available voices in a class attribute.
+        try:
+            with open(cog_data_path(self) / "voices.json") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        self.voices_etag = data.get("etag")
+        self.voices_last_modified = data.get("last_modified")
+        self.set_voices(data.get("voices", []))
+
+    def _save_voices(self, data: dict) -> None:
+        path = cog_data_path(self) / "voices.json"
+        with open(path.with_suffix(".tmp"), "w") as f:
+            json.dump(data, f)
+        os.replace(path.with_suffix(".tmp"), path)
+
+    async def refresh_voices(self) -> bool:
+        """
+        Stores all the available voices in a class attribute and saves them to disk.
 
         We do this so we don't have to make a request every time we want to play a sound.
 
-        It runs every 12 hours since it's uncommon voices will change.
+        The request is conditional, so if the voices haven't changed nothing is downloaded.
+        Returns whether the TTS API answered.
         """
-        async with self.session.get(f"{self.TTS_API_URL}/voices") as req:
-            if req.status == 200:
-                self.voices = (await req.json())["voices"]
+        headers = {}
+        if self.voices:
+            if self.voices_etag:
+                headers["If-None-Match"] = self.voices_etag
+            if self.voices_last_modified:
+                headers["If-Modified-Since"] = self.voices_last_modified
 
-    @tasks.loop(seconds=5)
-    async def maybe_get_voices(self) -> None:
+        try:
+            async with self.session.get(
+                f"{self.TTS_API_URL}/voices", headers=headers
+            ) as req:
+                if req.status == 304:
+                    return True
+                if req.status != 200:
+                    return False
+                voices = (await req.json())["voices"]
+                etag = req.headers.get("ETag")
+                last_modified = req.headers.get("Last-Modified")
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError):
+            return False
+
+        self.voices_etag = etag
+        self.voices_last_modified = last_modified
+        self.set_voices(voices)
+        try:
+            await self.bot.loop.run_in_executor(
+                None,
+                self._save_voices,
+                {"etag": etag, "last_modified": last_modified, "voices": voices},
+            )
+        except OSError:
+            # The voices are still up to date in memory, they just won't survive a restart
+            log.exception("Couldn't save the TTS voices")
+        return True
+
+    async def refresh_voices_loop(self) -> None:
+        """
+        Refreshes the voices every 12 hours since it's uncommon voices will change.
+
+        If the TTS API is down, it's retried with exponential backoff instead.
+        Unexpected errors are logged and retried the same way, so they don't stop the loop.
+        """
+        while True:
+            try:
+                refreshed = await self.refresh_voices()
+            except Exception:
+                log.exception("Error refreshing the TTS voices")
+                refreshed = False
+            if refreshed:
+                self.voices_health.success()
+                await asyncio.sleep(43200)
+            else:
+                self.voices_health.failure()
+                await asyncio.sleep(self.voices_health.retry_in)
+
+    @tasks.loop(minutes=10)
+    async def evict_idle_caches(self) -> None:
+        """
+        Drops cached settings that haven't been used in a while, expired permission checks
+        and refilled rate limit buckets, so the caches only hold entries for guilds and
+        users that are active.
+        """
+        self.config_cache.evict_idle()
+        self.permission_cache.prune()
+        self.tts_limiter.prune()
+        self.freesound_limiter.prune()
+        for state in self.playback.evict_idle():
+            if not state.idle:
+                self.restore_repeat(state)
+
+    @tasks.loop(minutes=1)
+    async def export_metrics(self) -> None:
         """
-        If the TTS API was down for some reason and we can't get the voices, we'll try again every 5 seconds.
+        Writes the TTS latency metrics to a file in the Prometheus text format, if a path is set.
 
-        If there's already voices, we can just ignore this since it'll try again in 48 hours.
+        The file is replaced in one go, so a collector never reads half of it.
+        """
+        path = await self.config.metrics_path()
+        if path:
+            await self.write_metrics(path)
+
+    async def write_metrics(self, path: str) -> bool:
+        """
+        Writes the TTS latency metrics to a file. Returns whether it worked.
         """
-        if not self.voices:
-            await self.get_voices()
+
+        def write(text: str):
+            temp = f"{path}.tmp"
+            with open(temp, "w") as f:
+                f.write(text)
+            os.replace(temp, path)
+
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                None, write, self.metrics.prometheus()
+            )
+        except OSError:
+            log.exception("Couldn't write the TTS metrics to %s", path)
+            return False
+        return True
 
     async def reset_player_states(self) -> None:
         """
@@ -131,12 +370,102 @@ class SFX(
 
         This is called when the cog is unloaded so that the rll repeat states matches the Audio config repeat states.
         """
-        for guild_id in self.last_track_info.keys():
-            try:
-                player = lavalink.get_player(guild_id)
-            except NoLavalinkNode:  # Lavalink is probably shutting down
-                continue
-            player.repeat = self.repeat_state[guild_id]
+        for state in self.playback:
+            if not state.idle:
+                self.restore_repeat(state)
+
+    def restore_repeat(self, state: PlaybackState) -> None:
+        """
+        Sets a guild's player back to the repeat state it had before the cog played anything.
+        """
+        if state.repeat is None:
+            return
+        try:
+            player = lavalink.get_player(state.guild_id)
+        except (NoLavalinkNode, KeyError, PlayerNotFound):
+            return
+        player.repeat = state.repeat
+
+    async def load_indexes(self) -> None:
+        """
+        Loads which users have AutoTTS enabled and which channels are TTS channels.
+        """
+        for guild_id, data in (await self.config.all_guilds()).items():
+            if data.get("autotts_users"):
+                self.autotts[guild_id] = set(data["autotts_users"])
+            if data.get("channels"):
+                self.tts_channels[guild_id] = set(data["channels"])
+
+        # AutoTTS is turned off when a user leaves voice, which we can't see while the bot is offline
+        await self.bot.wait_until_red_ready()
+        for guild_id, users in list(self.autotts.items()):
+            guild = self.bot.get_guild(guild_id)
+            for user_id in list(users):
+                member = guild.get_member(user_id) if guild else None
+                if not member or not member.voice or not member.voice.channel:
+                    await self.set_autotts(guild_id, user_id, False)
+
+    async def load_cache_size(self) -> None:
+        """
+        Applies the configured TTS cache size.
+        """
+        self.tts_cache.resize(await self.config.cache_size() * 1048576)
+
+    async def load_disabled_backends(self) -> None:
+        """
+        Applies which TTS backends the owner turned off.
+        """
+        disabled = await self.config.disabled_backends()
+        for name, stats in self.tts_router.stats.items():
+            stats.enabled = name not in disabled
+
+    async def start_relay(self) -> None:
+        """
+        Starts the local audio relay that lets Lavalink play audio the bot has on hand.
+
+        If it's disabled or can't bind, cached audio is given to Lavalink as a file path instead.
+        """
+        await self.stop_relay()
+        settings = await self.config.all()
+        if not settings["relay_enabled"]:
+            return
+
+        relay = AudioRelay(
+            settings["relay_host"],
+            settings["relay_port"],
+            settings["relay_advertise"],
+        )
+        try:
+            await relay.start()
+        except OSError:
+            return
+        self.relay = relay
+
+    async def stop_relay(self) -> None:
+        """
+        Stops the local audio relay if it's running.
+        """
+        if self.relay:
+            relay, self.relay = self.relay, None
+            await relay.close()
+            self.tts_streams.clear()
+
+    def local_url(self, path: Path) -> str:
+        """
+        Gets the URL that Lavalink should use to play a local file.
+        """
+        if self.relay:
+            return self.relay.url(self.relay.add_file(path))
+        return str(path)
+
+    def is_local_url(self, url: str) -> bool:
+        """
+        Whether a URL is one from local_url or the relay, which Lavalink can only load
+        if it can reach the bot.
+        """
+        if self.relay and url.startswith(self.relay.url("")):
+            return True
+        return not url.startswith(("http://", "https://"))
 
     async def set_token(self) -> None:
         """
@@ -158,57 +487,514 @@ class SFX(
         if service_name == "freesound":
             self.id = api_tokens.get("id")
             self.key = api_tokens.get("key")
+            self.freesound.clear()
 
     def generate_url(
-        self, voice: str, translate: bool, text: str, speed: float, format: str
+        self,
+        voice: str,
+        translate: bool,
+        text: str,
+        speed: float,
+        format: str,
+        silence: int = 500,
     ) -> str:
         """
         Generates the URL for the TTS using kaogurai's TTS API.
         """
-        return f"{self.TTS_API_URL}?voice={voice}&translate={translate}&text={quote(text)}&silence=500&audio_format={format}&speed={speed}"
+        return self.flowery.url(voice, translate, text, speed, format, silence)
+
+    async def get_tts_audio(
+        self,
+        voice: str,
+        translate: bool,
+        text: str,
+        speed: float,
+        format: str,
+        guild_id: Optional[int] = None,
+        info: Optional[RenderInfo] = None,
+        silence: int = 500,
+    ) -> Optional[Path]:
+        """
+        Gets the path to a rendered TTS file, rendering and caching it if needed.
+
+        Concurrent requests for the same render share a single render, which counts
+        against the rate limit of the guild that asked first. If info is given, it's
+        marked when the audio came from a fallback backend. silence is how many
+        milliseconds of silence the audio ends with.
+        Returns None if no TTS backend could render it.
+        """
+        key = self.tts_cache.make_key(
+            voice, translate, text, speed, format, silence=silence
+        )
+        path = self.tts_cache.get(key, format)
+        if path:
+            return path
+
+        task = self.tts_renders.get(key)
+        if not task:
+            task = asyncio.create_task(
+                self._render_tts(
+                    key, voice, translate, text, speed, format, guild_id, silence
+                )
+            )
+            self.tts_renders[key] = task
+            task.add_done_callback(lambda _: self.tts_renders.pop(key, None))
+
+        rendered = await asyncio.shield(task)
+        if not rendered:
+            return None
+        path, fallback = rendered
+        if info and fallback:
+            info.fallback = True
+        return path
+
+    async def _render_tts(
+        self,
+        key: str,
+        voice: str,
+        translate: bool,
+        text: str,
+        speed: float,
+        format: str,
+        guild_id: Optional[int],
+        silence: int,
+    ) -> Optional[Tuple[Path, bool]]:
+        """
+        Renders TTS into the cache. Returns its path and whether a fallback backend rendered it.
+
+        Fallback renders are stored under their own key, so the real voice is rendered
+        again once its backend is back.
+        """
+        info = RenderInfo()
+        try:
+            chunks = self.tts_router.stream(
+                voice, translate, text, speed, format, guild_id, info, silence
+            )
+            data = b"".join([chunk async for chunk in chunks])
+        except TTSError:
+            return None
+
+        if not data:
+            return None
+
+        if info.fallback:
+            key = self.tts_cache.make_key(
+                voice, translate, text, speed, format, "fallback", silence
+            )
+        return await self.tts_cache.put(key, format, data), info.fallback
+
+    def tts_source(
+        self,
+        voice: str,
+        translate: bool,
+        text: str,
+        speed: float,
+        prefix: Optional[str] = None,
+        guild_id: Optional[int] = None,
+    ) -> Tuple[Source, Optional[str]]:
+        """
+        Gets a source for play_sound that renders the TTS when it's about to play,
+        and the API URL to fall back to.
+
+        If the TTS API is rate limited and nothing else can render, the source
+        resolves to None so the sound is dropped, instead of going to the API
+        directly through the fallback URL.
+
+        Long text is split into sentences that are rendered in parallel and played
+        back to back as one track, with only the last one ending in silence. There's
+        no fallback URL for long text, since the whole text could be too long for a
+        URL and playing only part of it would cut the message short. If Lavalink
+        can't load it from the bot, the user is told why instead.
+
+        A prefix, like the speaker's name, is rendered and cached on its own and joined
+        onto the text, so the text's render can still be reused.
+
+        The time it takes is recorded as the render stage for guild_id, and the
+        renders count against its rate limit.
+        """
+        parts = split_text(text) or [text]
+        url = (
+            self.generate_url(voice, translate, text, speed, "ogg_opus")
+            if len(parts) == 1
+            else None
+        )
+
+        async def render() -> Optional[str]:
+            info = RenderInfo()
+            key = self.tts_cache.make_key(voice, translate, text, speed, "ogg_opus")
+            path = self.tts_cache.get(key, "ogg_opus")
+            if path and not prefix:
+                return self.local_url(path)
+
+            if prefix:
+                prefixed_key = self.tts_cache.make_key(
+                    voice, translate, f"{prefix} {text}", speed, "ogg_opus"
+                )
+                # Without the relay, the joined clip has to be saved to be played
+                prefixed_path = self.tts_cache.get(prefixed_key, "ogg_opus")
+                if prefixed_path and not self.relay:
+                    return self.local_url(prefixed_path)
+
+            if path:
+                chunks = self._read(path)
+            elif len(parts) == 1:
+                if not prefix and not self.relay:
+                    try:
+                        path = await self.get_tts_audio(
+                            voice, translate, text, speed, "ogg_opus", guild_id
+                        )
+                    except RateLimited:
+                        return None
+                    return self.local_url(path) if path else url
+                chunks = self._cached(
+                    key,
+                    self.tts_router.stream(
+                        voice, translate, text, speed, "ogg_opus", guild_id, info
+                    ),
+                    info,
+                )
+            else:
+                chunks = self._cached(
+                    key,
+                    self._render_parts(voice, translate, parts, speed, guild_id, info),
+                    info,
+                )
+
+            if prefix:
+                chunks = self._prefixed(
+                    voice, translate, prefix, speed, chunks, guild_id, info
+                )
+                key = prefixed_key
+
+            if self.relay:
+                clip_id = self.stream_tts(key, chunks)
+                # Lavalink can't start before the first audio anyway
+                if isinstance(await self.relay.wait_started(clip_id), RateLimited):
+                    return None
+                return self.relay.url(clip_id)
+            try:
+                data = b"".join([chunk async for chunk in chunks])
+            except RateLimited:
+                return None
+            except (TTSError, OSError, OggError):
+                return url
+            if info.fallback:
+                key = self.tts_cache.make_key(
+                    voice,
+                    translate,
+                    f"{prefix} {text}" if prefix else text,
+                    speed,
+                    "ogg_opus",
+                    "fallback",
+                )
+            return self.local_url(await self.tts_cache.put(key, "ogg_opus", data))
+
+        async def timed() -> Optional[str]:
+            with self.metrics.time("render", guild_id):
+                return await render()
+
+        return timed, url
+
+    async def render_tts_file(
+        self, voice: str, translate: bool, text: str, speed: float
+    ) -> Optional[Path]:
+        """
+        Renders text to a cached Ogg file, splitting long text the same way tts_source does.
+
+        Returns None if it couldn't be rendered. Raises RateLimited if the TTS API is busy.
+        """
+        parts = split_text(text) or [text]
+        if len(parts) == 1:
+            return await self.get_tts_audio(voice, translate, text, speed, "ogg_opus")
 
-    def get_voice(self, voice: str) -> dict:
+        key = self.tts_cache.make_key(voice, translate, text, speed, "ogg_opus")
+        path = self.tts_cache.get(key, "ogg_opus")
+        if path:
+            return path
+        info = RenderInfo()
+        try:
+            chunks = self._render_parts(voice, translate, parts, speed, None, info)
+            data = b"".join([chunk async for chunk in chunks])
+        except (TTSError, OSError, OggError):
+            return None
+        if info.fallback:
+            key = self.tts_cache.make_key(
+                voice, translate, text, speed, "ogg_opus", "fallback"
+            )
+        return await self.tts_cache.put(key, "ogg_opus", data)
+
+    async def broadcast(
+        self,
+        path: Path,
+        players: list,
+        track_info: tuple,
+    ) -> Dict[int, str]:
+        """
+        Plays one rendered file in every player's channel, and returns how it went in each guild.
+
+        The file is handed to Lavalink by the same URL everywhere, so Lavalink only
+        has to load it once per node. Only BROADCAST_WORKERS guilds are waited on at
+        once, so a big broadcast doesn't flood Lavalink.
+        """
+        url = self.local_url(path)
+        semaphore = asyncio.Semaphore(self.BROADCAST_WORKERS)
+        results: Dict[int, str] = {}
+
+        async def deliver(player) -> None:
+            guild_id = player.guild.id
+            async with semaphore:
+                try:
+                    future = await self.play_sound(
+                        player.channel, None, "broadcast", url, track_info
+                    )
+                    played = await asyncio.wait_for(
+                        future, timeout=self.BROADCAST_TIMEOUT
+                    )
+                except asyncio.TimeoutError:
+                    results[guild_id] = "Timed out"
+                except Exception:
+                    log.exception("Error broadcasting to guild %s", guild_id)
+                    results[guild_id] = "Error"
+                else:
+                    results[guild_id] = "Played" if played else "Dropped"
+
+        await asyncio.gather(*(deliver(player) for player in players))
+        return results
+
+    async def _read(self, path: Path) -> AsyncIterator[bytes]:
+        yield await asyncio.get_running_loop().run_in_executor(None, path.read_bytes)
+
+    async def _cached(
+        self, key: str, chunks: AsyncIterator[bytes], info: RenderInfo
+    ) -> AsyncIterator[bytes]:
+        """
+        Passes chunks through, and adds them to the TTS cache once they're all there,
+        unless a fallback backend rendered any of them.
+        """
+        data = bytearray()
+        async for chunk in chunks:
+            data.extend(chunk)
+            yield chunk
+        if is_complete(data) and not info.fallback:
+            await self.tts_cache.put(key, "ogg_opus", bytes(data))
+
+    async def _render_parts(
+        self,
+        voice: str,
+        translate: bool,
+        parts: List[str],
+        speed: float,
+        guild_id: Optional[int],
+        info: RenderInfo,
+    ) -> AsyncIterator[bytes]:
+        """
+        Renders parts of a message in parallel, and yields them in order as one chained Ogg stream.
+
+        Only the last part ends in silence, so there are no gaps between the others.
+        """
+        semaphore = asyncio.Semaphore(self.RENDER_WORKERS)
+
+        async def render(part: str, silence: int) -> Optional[Path]:
+            async with semaphore:
+                return await self.get_tts_audio(
+                    voice, translate, part, speed, "ogg_opus", guild_id, info, silence
+                )
+
+        tasks = [
+            asyncio.create_task(render(part, 500 if i == len(parts) - 1 else 0))
+            for i, part in enumerate(parts)
+        ]
+        chain = OggChain()
+        try:
+            for task in tasks:
+                path = await task
+                if not path:
+                    raise TTSError("A part of the message couldn't be rendered")
+                data = await asyncio.get_running_loop().run_in_executor(
+                    None, path.read_bytes
+                )
+                yield b"".join(chain.pages(data))
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _prefixed(
+        self,
+        voice: str,
+        translate: bool,
+        prefix: str,
+        speed: float,
+        chunks: AsyncIterator[bytes],
+        guild_id: Optional[int],
+        info: RenderInfo,
+    ) -> AsyncIterator[bytes]:
+        """
+        Yields the render of a prefix, then the Ogg stream from chunks, chained together.
+
+        The prefix is rendered without trailing silence, so it runs straight into the text.
+        """
+        path = await self.get_tts_audio(
+            voice, translate, prefix, speed, "ogg_opus", guild_id, info, silence=0
+        )
+        chain = OggChain()
+        if path:
+            data = await asyncio.get_running_loop().run_in_executor(
+                None, path.read_bytes
+            )
+            yield b"".join(chain.pages(data))
+
+        reader = OggPageReader()
+        async for chunk in chunks:
+            pages = reader.feed(chunk)
+            if pages:
+                yield b"".join(chain.pages(b"".join(pages)))
+        if reader.pending:
+            raise OggError("The stream ended in the middle of a page")
+
+    def stream_tts(self, key: str, chunks: AsyncIterator[bytes]) -> str:
+        """
+        Starts relaying a TTS render while it arrives, and returns its clip id.
+
+        Lavalink can start playing as soon as the first Ogg pages arrive, instead of
+        waiting for the whole render. Identical renders that are still streaming share
+        one stream.
+        """
+        clip_id = self.tts_streams.get(key)
+        if clip_id:
+            return clip_id
+
+        async def relay_chunks():
+            try:
+                async for chunk in chunks:
+                    yield chunk
+            finally:
+                # Later requests use the cache, or try again if this failed
+                self.tts_streams.pop(key, None)
+
+        clip_id = self.relay.add_stream(relay_chunks(), "audio/ogg", ".ogg")
+        self.tts_streams[key] = clip_id
+        return clip_id
+
+    def set_voices(self, voices: List[dict]) -> None:
+        """
+        Replaces the available voices and rebuilds the voice index.
+
+        Voices without a name can't be picked, so they're left out.
+        """
+        voices = [
+            voice
+            for voice in voices
+            if isinstance(voice, dict) and isinstance(voice.get("name"), str)
+        ]
+        self.voices = voices
+        self.voice_index = VoiceIndex(voices)
+        self.voice_catalog = VoiceCatalog(self.voice_index)
+
+    def get_voice(self, voice: str) -> Optional[dict]:
         """
         Gets the voice from the voices list.
         """
-        for v in self.voices:
-            if v["name"] == voice:
-                return v
+        return self.voice_index.get(voice)
 
     async def can_tts(self, message: discord.Message) -> bool:
         """
         Checks if the user of the message can use the TTS command.
+
+        Building a context and running the command's checks is expensive, so the
+        result is cached until something that could change it happens.
         """
-        ctx = await self.bot.get_context(message)
-        command = self.bot.get_command("tts")
+        with self.metrics.time("can_tts", message.guild.id):
+            key = (
+                message.channel.id,
+                message.author.id,
+                frozenset(role.id for role in message.author.roles),
+            )
+            can = self.permission_cache.get(message.guild.id, key)
+            if can is not None:
+                return can
 
-        try:
-            can = await command.can_run(ctx, change_permission_state=False)
-        except commands.CommandError:
-            can = False
+            ctx = await self.bot.get_context(message)
+            command = self.bot.get_command("tts")
 
-        return can
+            try:
+                can = await command.can_run(ctx, change_permission_state=False)
+            except commands.CommandError:
+                can = False
+
+            self.permission_cache.set(message.guild.id, key, can)
+            return can
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        if before.roles != after.roles:
+            self.permission_cache.invalidate_member(after.guild.id, after.id)
+
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before: discord.Role, after: discord.Role):
+        self.permission_cache.invalidate_guild(after.guild.id)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role):
+        self.permission_cache.invalidate_guild(role.guild.id)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_update(
+        self, before: discord.abc.GuildChannel, after: discord.abc.GuildChannel
+    ):
+        self.permission_cache.invalidate_channel(after.guild.id, after.id)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
+        self.permission_cache.invalidate_channel(channel.guild.id, channel.id)
+
+    @commands.Cog.listener(name="on_voice_state_update")
+    async def playback_voice_listener(
+        self,
+        member: discord.Member,
+        before: discord.VoiceState,
+        after: discord.VoiceState,
+    ):
+        """
+        Drops a guild's playback state when the bot leaves voice there.
+        """
+        if member.id == self.bot.user.id and before.channel and not after.channel:
+            self.playback.discard(member.guild.id)
+
+    @commands.Cog.listener()
+    async def on_command_completion(self, ctx: Context):
+        """
+        Clears the permission cache when a command that changes who can run commands is used.
+        """
+        root = ctx.command.root_parent or ctx.command
+        if root.qualified_name in self.PERMISSION_COMMANDS:
+            self.permission_cache.clear()
 
     async def process_text(
         self, guild: discord.Guild, author: discord.User, text: str
     ) -> str:
         """
-        This processes text for being spoken by removing links and potentially
-        adding the users name. This is not used when TTS is downloaded.
+        This processes text for being spoken with the guild's normalization settings.
+        This is not used when TTS is downloaded.
         """
-
-        # Remove links
-        text = re.sub(
-            r"http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+",
-            "link removed",
+        guild_config = await self.config_cache.guild(guild)
+        return normalize_text(
             text,
+            guild,
+            guild_config["emoji_mode"],
+            guild_config["mention_mode"],
+            guild_config["max_tts_length"],
         )
 
-        # Display name
-        say_name = await self.config.guild(guild).say_name()
-        if say_name:
-            return f"{author.display_name} says {text}"
-        return text
+    async def name_prefix(
+        self, guild: discord.Guild, author: discord.User
+    ) -> Optional[str]:
+        """
+        Gets what to say before a user's TTS, if the guild has names turned on.
+        """
+        guild_config = await self.config_cache.guild(guild)
+        if guild_config["say_name"]:
+            return f"{author.display_name} says"
+        return None
 
     async def play_tts(
         self,
@@ -217,11 +1003,17 @@ class SFX(
         text_channel: discord.TextChannel,
         type: str,
         text: str,
+        prefix: Optional[str] = None,
     ) -> None:
         """
         Validates the user's voice still exists and plays the TTS.
         """
-        author_data = await self.config.user(user).all()
+        if not text:
+            return
+
+        guild_id = voice_channel.guild.id
+        with self.metrics.time("config", guild_id):
+            author_data = await self.config_cache.user(user)
         author_voice = author_data["voice"]
         author_translate = author_data["translate"]
         author_speed = author_data["speed"]
@@ -229,10 +1021,11 @@ class SFX(
         is_voice = self.get_voice(author_voice)
         if not is_voice and self.voices:
             await self.config.user(user).voice.clear()
+            self.config_cache.invalidate_user(user.id)
             author_voice = await self.config.user(user).voice()
 
-        url = self.generate_url(
-            author_voice, author_translate, text, author_speed, "ogg_opus"
+        source, url = self.tts_source(
+            author_voice, author_translate, text, author_speed, prefix, guild_id
         )
 
         track_info = ("Text to Speech", user)
@@ -241,8 +1034,9 @@ class SFX(
             voice_channel,
             text_channel,
             type,
-            url,
+            source,
             track_info,
+            fallback_url=url,
         )
 
     async def play_sound(
@@ -250,18 +1044,61 @@ class SFX(
         vc: discord.VoiceChannel,
         channel: Optional[discord.TextChannel],
         type: str,
-        url: str,
+        url: Source,
         track_info: tuple,
-    ) -> None:
+        fallback_url: Optional[str] = None,
+        merge_key: Optional[Hashable] = None,
+    ) -> asyncio.Future:
         """
-        Plays an audio file in a voice channel.
+        Queues an audio file to be played in a voice channel.
+
+        Sounds are played one at a time per guild, with TTS first, then SFX, then join/leave sounds.
 
         Parameters:
         vc: The voice channel to play the audio in.
         channel: The text channel to send messages in. Can be None.
-        type: The type of SFX to play. (joinleave, tts, sfx, autotts, ttschannel)
-        url: The URL to play.
+        type: The type of SFX to play. (joinleave, tts, sfx, autotts, ttschannel, broadcast)
+        url: The URL to play, or a coroutine function that returns it. The function is only called when the sound is about to play.
         track_info: Tuple of track name and author (discord.py object).
+        fallback_url: A URL to try if Lavalink can't load the first one, such as when a cached file is local to the bot but Lavalink is not.
+        merge_key: Sounds with the same key aren't queued more than once.
+
+        Returns a future that resolves to whether the sound was played.
+        """
+
+        async def play(request: PlaybackRequest, resolved: str):
+            return await self._play_now(
+                request,
+                vc,
+                channel,
+                type,
+                resolved,
+                track_info,
+                fallback_url if fallback_url != resolved else None,
+            )
+
+        request = PlaybackRequest(vc.guild.id, type, url, play, merge_key)
+        queued = self.scheduler.submit(request)
+        if not queued and channel and type in ("tts", "sfx") and merge_key is None:
+            await channel.send(
+                "There are too many sounds queued right now, please try again in a bit."
+            )
+        return request.future
+
+    async def _play_now(
+        self,
+        request: PlaybackRequest,
+        vc: discord.VoiceChannel,
+        channel: Optional[discord.TextChannel],
+        type: str,
+        url: str,
+        track_info: tuple,
+        fallback_url: Optional[str],
+    ) -> Optional[asyncio.Future]:
+        """
+        Plays an audio file in a voice channel right away. Only the scheduler calls this.
+
+        Returns a future that resolves when the sound finishes, or None if it couldn't be played.
         """
         try:
             player = lavalink.get_player(vc.guild.id)
@@ -274,92 +1111,185 @@ class SFX(
         except (KeyError, PlayerNotFound):
             player = await lavalink.connect(vc)
 
-        repeat_state = player.repeat
-        player.repeat = False
+        # Only TTS is timed, since that's what the latency metrics are for
+        timed = request.priority == PRIORITIES["tts"]
+        if timed:
+            self.metrics.observe(
+                "queue", vc.guild.id, request.dequeued_at - request.queued_at
+            )
 
-        tracks = await player.load_tracks(query=url)
-        if not tracks or not tracks.tracks:
+        start = time.perf_counter()
+        track = await self.load_track(player, url)
+        if not track and fallback_url:
+            track = await self.load_track(player, fallback_url)
+        if timed:
+            self.metrics.observe(
+                "load_tracks", vc.guild.id, time.perf_counter() - start
+            )
+        if not track:
+            if self.is_local_url(url) and not fallback_url:
+                if not self.warned_unreachable:
+                    self.warned_unreachable = True
+                    log.warning(
+                        "Lavalink couldn't load audio from the bot. If Lavalink runs on "
+                        "another machine, enable the relay and set the address it can "
+                        "be reached on with `sfxset relay`."
+                    )
+                if channel and type != "autotts":
+                    await channel.send(
+                        "Lavalink can't reach the audio I rendered, so I can't play that. "
+                        "The bot owner may need to set up the audio relay with `sfxset relay`."
+                    )
+                return
             if channel and type != "autotts":
                 await channel.send("Something went wrong.")
             return
 
-        track = tracks.tracks[0]
         track_title, track_requester = track_info
         track.title = track_title
         track.requester = track_requester
         track.author = ""
-        self.repeat_state[vc.guild.id] = repeat_state
+        request.length = track.length
+
+        # Only remember the repeat state if it isn't already overridden by a previous sound
+        state = self.playback.get_or_create(vc.guild.id)
+        if not state.sfx:
+            state.repeat = player.repeat
+        player.repeat = False
 
         if type == "sfx":
             await channel.send(f"Playing **{track_title}**...")
 
+        state.finish()
+        finished = state.finished = asyncio.get_running_loop().create_future()
+        state.start_requested = time.perf_counter() if timed else None
+
         # No queue or anything, just add and play
         if not player.current and not player.queue:
             player.queue.append(track)
-            self.current_sfx[vc.guild.id] = track
+            state.sfx = track
             await player.play()
-            return
+            return finished
 
         # There's already an SFX or TTS playing, so we can just skip it
-        if vc.guild.id in self.current_sfx.keys() and self.current_sfx[vc.guild.id]:
+        if state.sfx:
             player.queue.insert(0, track)
+            state.sfx = track
             await player.skip()
-            self.current_sfx[vc.guild.id] = track
-            return
+            return finished
 
         # There's music playing, so we need to store what to set it back to
         # and then move song to second position (1) and skip
-        self.last_track_info[vc.guild.id] = (player.current, player.position)
-        self.current_sfx[vc.guild.id] = track
+        state.resume_track = player.current
+        state.resume_position = player.position
+        state.sfx = track
         player.queue.insert(0, track)
         player.queue.insert(1, player.current)
         await player.skip()
+        return finished
+
+    async def load_track(self, player, url: str) -> Optional[lavalink.Track]:
+        """
+        Resolves a URL to a track that's safe to change, using the track cache when possible.
+
+        Relay streams and TTS API URLs are for a single message, so they aren't cached.
+        """
+        cacheable = not url.startswith(self.TTS_API_URL) and not (
+            self.relay and self.relay.is_stream(url)
+        )
+        if cacheable:
+            track = self.track_cache.get(player.node, url)
+            if track:
+                return track
+
+        tracks = await player.load_tracks(query=url)
+        if not tracks or not tracks.tracks:
+            return None
+        if cacheable:
+            self.track_cache.set(player.node, url, tracks.tracks[0])
+        return copy.copy(tracks.tracks[0])
 
     async def ll_check(self, player, event, reason) -> None:
-        guild_current_sfx = self.current_sfx.get(player.guild.id, None)
-        guild_last_track_info = self.last_track_info.get(player.guild.id, None)
+        # red-lavalink sends this to every player on a node when the node reconnects
+        if (
+            event == lavalink.LavalinkEvents.WEBSOCKET_CLOSED
+            and isinstance(reason, dict)
+            and reason.get("code") == LAVALINK_RECONNECTED
+        ):
+            self.track_cache.invalidate_node(player.node)
+
+        state = self.playback.get(player.guild.id)
 
         # There's nothing to do, so just return
-        if not guild_current_sfx and not guild_last_track_info:
+        if not state or state.idle:
             return
+        state.touch()
+
+        if (
+            event == lavalink.LavalinkEvents.TRACK_START
+            and state.start_requested is not None
+            and player.current is state.sfx
+        ):
+            self.metrics.observe(
+                "start", state.guild_id, time.perf_counter() - state.start_requested
+            )
+            state.start_requested = None
+
+        # Don't replay a cached track that Lavalink can't play
+        if event == lavalink.LavalinkEvents.TRACK_EXCEPTION and state.sfx:
+            self.track_cache.invalidate_track(state.sfx)
+
+        # The sound we started failed, and the player won't move on from it with a
+        # normal TRACK_END, so let the scheduler play the next one now
+        if (
+            event
+            in (
+                lavalink.LavalinkEvents.TRACK_EXCEPTION,
+                lavalink.LavalinkEvents.TRACK_STUCK,
+            )
+            and state.sfx
+            and player.current is state.sfx
+        ):
+            state.finish()
+
+        # The sound we started has stopped playing, so the scheduler can play the next one
+        if (
+            event == lavalink.LavalinkEvents.TRACK_END
+            and state.sfx
+            and player.current is not state.sfx
+        ):
+            state.finish()
 
-        # The track failed to play, so we can just remove it from the current sfx cache
+        # The track failed to play, so we can just forget it
         # We'll also set the repeat state back to what it was before
         if (
-            event == lavalink.LavalinkEvents.TRACK_EXCEPTION
-            and not guild_current_sfx
-            or event == lavalink.LavalinkEvents.TRACK_STUCK
-            and not guild_current_sfx
+            event
+            in (
+                lavalink.LavalinkEvents.TRACK_EXCEPTION,
+                lavalink.LavalinkEvents.TRACK_STUCK,
+            )
+            and not state.sfx
         ):
-            if player.guild.id in self.current_sfx:
-                del self.current_sfx[player.guild.id]
-            if player.guild.id in self.repeat_state:
-                player.repeat = self.repeat_state[player.guild.id]
+            self.restore_repeat(state)
+            self.playback.discard(player.guild.id)
             return
 
-        # The track ended, but nothing was in the queue so we can just remove it from the current sfx cache
+        # The track ended, but nothing was in the queue so we can just forget it
         # We'll also set the repeat state back to what it was before
         if event == lavalink.LavalinkEvents.TRACK_END and not player.current:
-            if player.guild.id in self.current_sfx:
-                del self.current_sfx[player.guild.id]
-            if player.guild.id in self.repeat_state:
-                player.repeat = self.repeat_state[player.guild.id]
+            self.restore_repeat(state)
+            self.playback.discard(player.guild.id)
             return
 
-        # The track ended, but there's a queue, so we can just remove it from the current sfx cache
+        # The track ended, but there's a queue, so we can just forget the sound
         # Then we'll seek back to where the track was before
         # Lastly we'll also set the repeat state back to what it was before
         if (
             event == lavalink.LavalinkEvents.TRACK_END
-            and guild_last_track_info
+            and state.resume_track
             and player.current
-            and player.current.track_identifier
-            == guild_last_track_info[0].track_identifier
+            and player.current.track_identifier == state.resume_track.track_identifier
         ):
-            if player.guild.id in self.current_sfx:
-                del self.current_sfx[player.guild.id]
-            await player.seek(guild_last_track_info[1] + 2000)
-            if player.guild.id in self.last_track_info:
-                del self.last_track_info[player.guild.id]
-            if player.guild.id in self.repeat_state:
-                player.repeat = self.repeat_state[player.guild.id]
+            await player.seek(state.resume_position + 2000)
+            self.restore_repeat(state)
+            self.playback.discard(player.guild.id)
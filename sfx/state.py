@@ -0,0 +1,110 @@
+import asyncio
+import time
+from typing import Dict, Iterator, List, Optional
+
+import lavalink
+
+
+class PlaybackState:
+    """
+    What the cog is doing with a guild's player.
+
+    sfx is the track the cog is playing, resume_track and resume_position are the
+    music to go back to afterwards, and repeat is the player's repeat setting from
+    before the cog turned it off.
+    """
+
+    __slots__ = (
+        "guild_id",
+        "sfx",
+        "resume_track",
+        "resume_position",
+        "repeat",
+        "finished",
+        "start_requested",
+        "updated",
+    )
+
+    def __init__(self, guild_id: int):
+        self.guild_id = guild_id
+        self.sfx: Optional[lavalink.Track] = None
+        self.resume_track: Optional[lavalink.Track] = None
+        self.resume_position = 0
+        self.repeat: Optional[bool] = None
+        self.finished: Optional[asyncio.Future] = None
+        # When Lavalink was asked to start a TTS track, until it starts
+        self.start_requested: Optional[float] = None
+        self.updated = time.monotonic()
+
+    @property
+    def idle(self) -> bool:
+        return self.sfx is None and self.resume_track is None
+
+    def touch(self) -> None:
+        self.updated = time.monotonic()
+
+    def finish(self) -> None:
+        """
+        Lets the scheduler know the current sound is over.
+        """
+        if self.finished and not self.finished.done():
+            self.finished.set_result(None)
+        self.finished = None
+
+
+class PlaybackStates:
+    """
+    The playback state of every guild the cog is playing in.
+
+    States are dropped as soon as a guild is back to how it was, when the bot leaves
+    voice, or when they haven't changed in idle_timeout seconds, which covers missed
+    Lavalink events.
+    """
+
+    def __init__(self, idle_timeout: float = 600):
+        self.idle_timeout = idle_timeout
+        self._states: Dict[int, PlaybackState] = {}
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def __iter__(self) -> Iterator[PlaybackState]:
+        return iter(list(self._states.values()))
+
+    def get(self, guild_id: int) -> Optional[PlaybackState]:
+        return self._states.get(guild_id)
+
+    def get_or_create(self, guild_id: int) -> PlaybackState:
+        state = self._states.get(guild_id)
+        if state is None:
+            state = self._states[guild_id] = PlaybackState(guild_id)
+        state.touch()
+        return state
+
+    def discard(self, guild_id: int) -> Optional[PlaybackState]:
+        state = self._states.pop(guild_id, None)
+        if state:
+            state.finish()
+        return state
+
+    def evict_idle(self) -> List[PlaybackState]:
+        """
+        Drops states that haven't changed in a while, and returns them.
+        """
+        cutoff = time.monotonic() - self.idle_timeout
+        stale = [state for state in self._states.values() if state.updated < cutoff]
+        for state in stale:
+            self.discard(state.guild_id)
+        return stale
+
+    def counts(self) -> Dict[str, int]:
+        states = self._states.values()
+        return {
+            "guilds": len(self._states),
+            "playing": sum(state.sfx is not None for state in states),
+            "resuming": sum(state.resume_track is not None for state in states),
+            "waiting": sum(
+                state.finished is not None and not state.finished.done()
+                for state in states
+            ),
+        }
@@ -0,0 +1,287 @@
+import asyncio
+import contextlib
+import ipaddress
+import os
+import shutil
+import socket
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlparse
+
+import aiohttp
+from aiohttp.abc import ResolveResult
+
+
+class InvalidSound(Exception):
+    """
+    Raised when a sound can't be stored. The message is safe to show to users.
+    """
+
+
+def is_public(host: str) -> bool:
+    """
+    Whether an IP address is on the public internet, rather than loopback, a private
+    network, link-local (like cloud metadata services) or otherwise reserved.
+    """
+    address = ipaddress.ip_address(host)
+    if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    return address.is_global and not address.is_multicast
+
+
+class PublicResolver(aiohttp.ThreadedResolver):
+    """
+    Resolves host names, leaving out any addresses that aren't public.
+
+    Connections go to the addresses checked here, so a name can't resolve to a public
+    address when it's checked and a private one when it's connected to.
+    """
+
+    async def resolve(
+        self, host: str, port: int = 0, family: socket.AddressFamily = socket.AF_INET
+    ) -> List[ResolveResult]:
+        hosts = [
+            result
+            for result in await super().resolve(host, port, family)
+            if is_public(result["host"])
+        ]
+        if not hosts:
+            raise OSError(f"{host} doesn't resolve to a public address")
+        return hosts
+
+
+class SoundStore:
+    """
+    Stores join and leave sounds locally so they're downloaded once, when they're set,
+    rather than every time they're played.
+
+    Sounds can only be downloaded over HTTP(S) from public addresses, so users can't
+    make the bot fetch things from its own machine or network.
+
+    If FFmpeg is installed, sounds are checked against the duration limit and transcoded
+    to Opus, which Lavalink can play without transcoding. Otherwise they're stored as is.
+    """
+
+    MAX_SIZE = 8 * 1048576
+    MAX_DURATION = 20
+    MAX_REDIRECTS = 5
+    SUFFIXES = {
+        "audio/ogg": ".ogg",
+        "audio/opus": ".ogg",
+        "audio/mpeg": ".mp3",
+        "audio/mp3": ".mp3",
+        "audio/wav": ".wav",
+        "audio/x-wav": ".wav",
+    }
+
+    def __init__(self, path: Path, headers: Optional[dict] = None):
+        self.path = path
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.session = aiohttp.ClientSession(
+            headers=headers,
+            connector=aiohttp.TCPConnector(resolver=PublicResolver()),
+        )
+        self.ffmpeg = shutil.which("ffmpeg")
+        self.ffprobe = shutil.which("ffprobe")
+        self._index: Dict[Tuple[str, int, str], Path] = {}
+
+        for entry in os.scandir(self.path):
+            name, suffix = os.path.splitext(entry.name)
+            parts = name.split("-")
+            if (
+                entry.is_file()
+                and suffix != ".tmp"
+                and len(parts) == 3
+                and parts[1].isdigit()
+            ):
+                self._index[(parts[0], int(parts[1]), parts[2])] = Path(entry.path)
+
+    def get(self, scope: str, owner_id: int, kind: str) -> Optional[Path]:
+        """
+        Gets the stored sound for a guild or user, if there is one.
+
+        Scope is either "guild" or "user", and kind is either "join" or "leave".
+        """
+        return self._index.get((scope, owner_id, kind))
+
+    def delete(self, scope: str, owner_id: int, kind: str) -> None:
+        """
+        Deletes a stored sound.
+        """
+        path = self._index.pop((scope, owner_id, kind), None)
+        if path:
+            with contextlib.suppress(FileNotFoundError):
+                path.unlink()
+
+    async def close(self) -> None:
+        await self.session.close()
+
+    @staticmethod
+    def check_url(url: str) -> None:
+        """
+        Raises InvalidSound if a URL isn't HTTP(S), or is for an address that isn't public.
+
+        Host names are checked when they're resolved, by PublicResolver.
+        """
+        parsed = urlparse(url)
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            raise InvalidSound("Sounds have to be HTTP or HTTPS links.")
+        try:
+            public = is_public(parsed.hostname)
+        except ValueError:
+            # It's a host name, not an IP address
+            return
+        if not public:
+            raise InvalidSound("I can't download sounds from that address.")
+
+    async def download(self, url: str) -> Tuple[bytes, str]:
+        """
+        Downloads a sound, making sure it isn't too large.
+
+        Redirects are followed by hand, so every URL along the way is checked.
+        Returns its data and content type.
+        """
+        try:
+            for _ in range(self.MAX_REDIRECTS + 1):
+                self.check_url(url)
+                async with self.session.get(url, allow_redirects=False) as resp:
+                    if resp.status in (301, 302, 303, 307, 308):
+                        url = urljoin(url, resp.headers.get("Location", ""))
+                        continue
+                    return await self._read(resp)
+            raise InvalidSound("That sound redirects too many times.")
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            raise InvalidSound("I couldn't download that sound.")
+
+    async def _read(self, resp: aiohttp.ClientResponse) -> Tuple[bytes, str]:
+        if resp.status != 200:
+            raise InvalidSound("I couldn't download that sound.")
+        if (resp.content_length or 0) > self.MAX_SIZE:
+            raise InvalidSound(
+                f"That sound is too large. Sounds can be at most {self.MAX_SIZE // 1048576} MB."
+            )
+
+        data = bytearray()
+        async for chunk in resp.content.iter_chunked(65536):
+            data.extend(chunk)
+            if len(data) > self.MAX_SIZE:
+                raise InvalidSound(
+                    f"That sound is too large. Sounds can be at most {self.MAX_SIZE // 1048576} MB."
+                )
+        return bytes(data), resp.content_type
+
+    async def _run(self, *args: str) -> bytes:
+        proc = await asyncio.create_subprocess_exec(
+            *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        try:
+            stdout, _ = await asyncio.wait_for(proc.communicate(), timeout=30)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            raise InvalidSound("That sound took too long to process.")
+        if proc.returncode != 0:
+            raise InvalidSound("That doesn't seem to be a valid audio file.")
+        return stdout
+
+    async def duration(self, path: Path) -> Optional[float]:
+        """
+        Gets the duration of an audio file in seconds, if FFprobe is installed.
+        """
+        if not self.ffprobe:
+            return None
+        output = await self._run(
+            self.ffprobe,
+            "-v",
+            "error",
+            "-show_entries",
+            "format=duration",
+            "-of",
+            "csv=p=0",
+            "-protocol_whitelist",
+            "file,pipe",
+            str(path),
+        )
+        try:
+            return float(output.strip())
+        except ValueError:
+            raise InvalidSound("That doesn't seem to be a valid audio file.")
+
+    async def prepare(
+        self, data: bytes, content_type: str, base: Path
+    ) -> Tuple[Path, Optional[float]]:
+        """
+        Validates audio and writes it next to `base`, transcoding it to Opus if FFmpeg is installed.
+
+        Returns the path it was written to and its duration, if it's known.
+        Raises InvalidSound if it's empty, too long or not audio.
+        """
+        if not data:
+            raise InvalidSound("That sound is empty.")
+
+        tmp = base.with_name(f"{base.name}.tmp")
+        encoded = base.with_name(f"{base.name}.ogg.tmp")
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, tmp.write_bytes, data)
+
+        try:
+            duration = await self.duration(tmp)
+            if duration is not None and duration > self.MAX_DURATION:
+                raise InvalidSound(
+                    f"That sound is too long. Sounds can be at most {self.MAX_DURATION} seconds."
+                )
+
+            if self.ffmpeg:
+                path = base.with_name(f"{base.name}.ogg")
+                await self._run(
+                    self.ffmpeg,
+                    "-hide_banner",
+                    "-loglevel",
+                    "error",
+                    "-y",
+                    "-protocol_whitelist",
+                    "file,pipe",
+                    "-i",
+                    str(tmp),
+                    "-vn",
+                    "-c:a",
+                    "libopus",
+                    "-b:a",
+                    "96k",
+                    "-f",
+                    "ogg",
+                    str(encoded),
+                )
+                os.replace(encoded, path)
+            else:
+                path = base.with_name(
+                    base.name + self.SUFFIXES.get(content_type, ".bin")
+                )
+                os.replace(tmp, path)
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                tmp.unlink()
+            with contextlib.suppress(FileNotFoundError):
+                encoded.unlink()
+
+        return path, duration
+
+    async def save(self, scope: str, owner_id: int, kind: str, url: str) -> Path:
+        """
+        Downloads, validates and stores a sound, replacing any previous one.
+
+        Raises InvalidSound if it couldn't be downloaded or is too large or long.
+        """
+        data, content_type = await self.download(url)
+        path, _ = await self.prepare(
+            data, content_type, self.path / f"{scope}-{owner_id}-{kind}"
+        )
+
+        old = self._index.get((scope, owner_id, kind))
+        if old and old != path:
+            with contextlib.suppress(FileNotFoundError):
+                old.unlink()
+        self._index[(scope, owner_id, kind)] = path
+        return path
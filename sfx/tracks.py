@@ -0,0 +1,61 @@
+import copy
+from typing import Hashable, Optional
+
+import lavalink
+
+from .ttlcache import TTLCache
+
+
+class TrackCache:
+    """
+    Remembers what Lavalink resolved URLs to, so sounds that are played often skip
+    the load request.
+
+    Entries are per node, by its address, and a node's entries are forgotten when it
+    reconnects. Tracks that fail to play are forgotten too.
+    Callers get a copy of the cached track, which they're free to change.
+    """
+
+    def __init__(self, ttl: float = 3600, max_entries: int = 1024):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._tracks = TTLCache(max_entries)
+
+    @staticmethod
+    def node_key(node) -> Hashable:
+        return (node.host, node.port)
+
+    def get(self, node, url: str) -> Optional[lavalink.Track]:
+        track = self._tracks.get((self.node_key(node), url))
+        if track is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return copy.copy(track)
+
+    def set(self, node, url: str, track: lavalink.Track) -> None:
+        self._tracks.set((self.node_key(node), url), copy.copy(track), self.ttl)
+
+    def invalidate_track(self, track: lavalink.Track) -> None:
+        """
+        Forgets every URL that resolved to a track, such as when it couldn't be decoded.
+        """
+        for key, cached in self._tracks.items():
+            if cached.track_identifier == track.track_identifier:
+                self._tracks.discard(key)
+
+    def invalidate_node(self, node) -> None:
+        """
+        Forgets every track a node resolved, such as when it reconnected and lost them.
+        """
+        node_key = self.node_key(node)
+        for key, _ in self._tracks.items():
+            if key[0] == node_key:
+                self._tracks.discard(key)
+
+    def clear(self) -> None:
+        self._tracks.clear()
+
+    def __len__(self) -> int:
+        return len(self._tracks)
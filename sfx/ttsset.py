@@ -0,0 +1,105 @@
+from typing import Optional
+
+from redbot.core import commands
+from redbot.core.commands import Context
+
+from .abc import MixinMeta
+from .normalize import EMOJI_MODES, MENTION_MODES
+
+
+class TTSSettingsMixin(MixinMeta):
+    @commands.group()
+    @commands.guild_only()
+    @commands.admin_or_permissions(manage_guild=True)
+    async def ttsset(self, ctx: Context):
+        """
+        Configures how TTS works in this server.
+        """
+        pass
+
+    @ttsset.command(name="coalesce")
+    async def ttsset_coalesce(
+        self, ctx: Context, seconds: float, max_length: Optional[int] = None
+    ):
+        """
+        Sets how long to wait for more messages before speaking AutoTTS and TTS channel messages.
+
+        Messages a user sends within this window are spoken together, up to `max_length` characters. Use 0 to speak every message right away.
+
+        The default is 1 second and 400 characters.
+        """
+        if not 0 <= seconds <= 10:
+            await ctx.send("The window must be between 0 and 10 seconds.")
+            return
+        if max_length is not None and not 50 <= max_length <= 2000:
+            await ctx.send("The maximum length must be between 50 and 2000 characters.")
+            return
+
+        await self.config.guild(ctx.guild).coalesce_window.set(seconds)
+        self.config_cache.update_guild(ctx.guild.id, coalesce_window=seconds)
+        if max_length is not None:
+            await self.config.guild(ctx.guild).coalesce_max_length.set(max_length)
+            self.config_cache.update_guild(ctx.guild.id, coalesce_max_length=max_length)
+
+        if seconds:
+            await ctx.send(
+                f"Messages sent within {seconds} seconds of each other will now be spoken together."
+            )
+        else:
+            await ctx.send("Every message will now be spoken right away.")
+
+    @ttsset.command(name="emoji")
+    async def ttsset_emoji(self, ctx: Context, mode: str):
+        """
+        Sets how emoji are spoken.
+
+        `name` reads custom emoji by their name, and `strip` removes all emoji.
+
+        The default is `name`.
+        """
+        mode = mode.lower()
+        if mode not in EMOJI_MODES:
+            await ctx.send(f"The mode must be one of: {', '.join(EMOJI_MODES)}.")
+            return
+
+        await self.config.guild(ctx.guild).emoji_mode.set(mode)
+        self.config_cache.update_guild(ctx.guild.id, emoji_mode=mode)
+        await ctx.send(f"The emoji mode is now `{mode}`.")
+
+    @ttsset.command(name="mentions")
+    async def ttsset_mentions(self, ctx: Context, mode: str):
+        """
+        Sets how mentions of users, roles and channels are spoken.
+
+        `name` reads them by their name, and `strip` removes them.
+
+        The default is `name`.
+        """
+        mode = mode.lower()
+        if mode not in MENTION_MODES:
+            await ctx.send(f"The mode must be one of: {', '.join(MENTION_MODES)}.")
+            return
+
+        await self.config.guild(ctx.guild).mention_mode.set(mode)
+        self.config_cache.update_guild(ctx.guild.id, mention_mode=mode)
+        await ctx.send(f"The mention mode is now `{mode}`.")
+
+    @ttsset.command(name="maxlength")
+    async def ttsset_maxlength(self, ctx: Context, characters: Optional[int] = None):
+        """
+        Sets the most characters of a message that are spoken.
+
+        Longer messages are cut off at the last whole word. Leave it empty to speak whole messages again.
+
+        By default, messages aren't cut off.
+        """
+        if characters is not None and not 50 <= characters <= 2000:
+            await ctx.send("The maximum length must be between 50 and 2000 characters.")
+            return
+
+        await self.config.guild(ctx.guild).max_tts_length.set(characters)
+        self.config_cache.update_guild(ctx.guild.id, max_tts_length=characters)
+        if characters is None:
+            await ctx.send("Messages will no longer be cut off.")
+            return
+        await ctx.send(f"Messages will now be cut off after {characters} characters.")
@@ -0,0 +1,96 @@
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from rapidfuzz import fuzz, process, utils
+
+
+class VoiceIndex:
+    """
+    Lookup tables for the TTS voices, rebuilt whenever the voice list is refreshed.
+
+    Exact and case-insensitive lookups are dict lookups, and fuzzy matching runs
+    against choices that are preprocessed once per rebuild.
+    """
+
+    MAX_MATCHES = 512
+
+    def __init__(self, voices: List[dict]):
+        self.voices = voices
+        self.names = [voice["name"] for voice in voices]
+        self._by_name: Dict[str, dict] = {voice["name"]: voice for voice in voices}
+        self._by_lower: Dict[str, dict] = {}
+        self._by_language: Dict[str, List[dict]] = {}
+        self._by_gender: Dict[str, List[dict]] = {}
+        self._choices = [utils.default_process(name) for name in self.names]
+        self._matches: "OrderedDict[str, Optional[dict]]" = OrderedDict()
+
+        for voice in voices:
+            self._by_lower.setdefault(voice["name"].casefold(), voice)
+
+            gender = str(voice.get("gender", "")).casefold()
+            self._by_gender.setdefault(gender, []).append(voice)
+
+            language = voice.get("language") or {}
+            keys = set()
+            code = str(language.get("code", "")).casefold()
+            if code:
+                keys.add(code)
+                keys.add(code.split("-")[0])
+            if language.get("name"):
+                keys.add(language["name"].casefold())
+            for key in keys:
+                self._by_language.setdefault(key, []).append(voice)
+
+    def __len__(self) -> int:
+        return len(self.voices)
+
+    def get(self, name: str) -> Optional[dict]:
+        """
+        Gets a voice by its exact name.
+        """
+        return self._by_name.get(name)
+
+    def get_insensitive(self, name: str) -> Optional[dict]:
+        """
+        Gets a voice by its name, ignoring case.
+        """
+        return self._by_lower.get(name.casefold())
+
+    def filter(
+        self, language: Optional[str] = None, gender: Optional[str] = None
+    ) -> List[dict]:
+        """
+        Gets the voices for a language (code or name) and/or gender.
+        """
+        voices = self.voices
+        if language:
+            voices = self._by_language.get(language.casefold(), [])
+        if gender:
+            allowed = {id(v) for v in self._by_gender.get(gender.casefold(), [])}
+            voices = [v for v in voices if id(v) in allowed]
+        return voices
+
+    def match(self, query: str) -> Optional[dict]:
+        """
+        Gets the voice that best matches a query, trying an exact match first.
+        """
+        voice = self._by_name.get(query) or self._by_lower.get(query.casefold())
+        if voice or not self._choices:
+            return voice
+
+        if query in self._matches:
+            self._matches.move_to_end(query)
+            return self._matches[query]
+
+        result = process.extractOne(
+            utils.default_process(query),
+            self._choices,
+            scorer=fuzz.WRatio,
+            processor=None,
+        )
+        voice = self.voices[result[2]] if result else None
+
+        self._matches[query] = voice
+        if len(self._matches) > self.MAX_MATCHES:
+            self._matches.popitem(last=False)
+        return voice